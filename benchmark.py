@@ -0,0 +1,308 @@
+#!/usr/bin/env python3
+
+import argparse
+import gc
+import json
+import math
+import os
+import random
+import resource
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from output_utils import set_output_mode, format_size
+
+# Synthetic trees and fixture package databases for timing the scanner,
+# classifiers, tree view and package readers without touching the real
+# system. Everything is generated from a seed, so runs with the same
+# parameters see the same tree.
+
+SCALES = {
+    'small': {'dirs': 200, 'files': 20000, 'packages': 500},
+    'medium': {'dirs': 2000, 'files': 200000, 'packages': 2000},
+    'large': {'dirs': 20000, 'files': 2000000, 'packages': 5000},
+}
+NAME_SUFFIXES = ['.jpg', '.mp4', '.pdf', '.docx', '.txt', '.zip', '.tar.gz', '.tmp', '.bak', '.deb', '.sh', '.js',
+                 '.c', '.h', '.py', '.o', '', '.json', '.log', '.conf']
+# Every tree is backdated, so the scan index treats it as settled
+TREE_MTIME = 1577836800
+SIZE_STRINGS = ['12 KiB', '3.5 MiB', '1.2 GiB', '800 KB', '42 MB', '2 GB', '512']
+
+Stage = Tuple[str, Optional[Callable[[], Any]], Callable[[Any], Any]]
+
+def layout_dirs(root: str, dirs: int, layout: str, depth: int, rng: random.Random) -> List[str]:
+    paths = []
+    if layout == 'wide':
+        # Two levels: a fanout of about sqrt(dirs) at each
+        fanout = max(1, math.ceil(math.sqrt(dirs)))
+        for i in range(fanout):
+            top = os.path.join(root, f"d{i:04d}")
+            paths.append(top)
+            for j in range(fanout):
+                if len(paths) >= dirs:
+                    break
+                paths.append(os.path.join(top, f"s{j:04d}"))
+            if len(paths) >= dirs:
+                break
+    else:
+        # Chains of `depth` nested directories
+        chain = 0
+        while len(paths) < dirs:
+            path = os.path.join(root, f"chain{chain:04d}")
+            for level in range(min(depth, dirs - len(paths))):
+                path = os.path.join(path, f"l{level}") if level else path
+                paths.append(path)
+            chain += 1
+    return paths[:dirs]
+
+def generate_tree(root: str, dirs: int, files: int, layout: str, depth: int, hard_links: int, sparse: int,
+                  denied: int, seed: int) -> Dict[str, int]:
+    rng = random.Random(seed)
+    dir_paths = layout_dirs(root, dirs, layout, depth, rng)
+    for path in dir_paths:
+        os.makedirs(path, exist_ok=True)
+
+    payload = bytes(rng.randrange(256) for _ in range(4096))
+    total_bytes = 0
+    file_paths = []
+    for i in range(files):
+        size = rng.choice((0, 1, 17, 64, 200, 512, 1500, 4096))
+        path = os.path.join(dir_paths[i % len(dir_paths)], f"f{i:07d}{rng.choice(NAME_SUFFIXES)}")
+        fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+        if size:
+            os.write(fd, payload[:size])
+        os.close(fd)
+        total_bytes += size
+        if len(file_paths) < hard_links:
+            file_paths.append(path)
+
+    for i, target in enumerate(file_paths):
+        os.link(target, os.path.join(dir_paths[(i * 7 + 3) % len(dir_paths)], f"link{i:06d}"))
+
+    # Sparse files: large apparent size, almost nothing allocated
+    for i in range(sparse):
+        with open(os.path.join(dir_paths[i % len(dir_paths)], f"sparse{i:03d}.img"), "wb") as f:
+            f.truncate(1024 * 1024 * 1024)
+            f.write(b"\0")
+
+    denied_paths = []
+    for i in range(denied):
+        path = os.path.join(root, f"denied{i:03d}")
+        os.makedirs(os.path.join(path, "inner"), exist_ok=True)
+        with open(os.path.join(path, "inner", "secret.txt"), "w") as f:
+            f.write("x")
+        denied_paths.append(path)
+
+    # Deepest first, so setting a directory's mtime doesn't disturb its parent's
+    for dirpath, _, _ in sorted(os.walk(root), key=lambda entry: entry[0].count(os.sep), reverse=True):
+        os.utime(dirpath, (TREE_MTIME, TREE_MTIME))
+    for path in denied_paths:
+        os.chmod(path, 0)
+    return {'dirs': len(dir_paths), 'files': files, 'bytes': total_bytes, 'hard_links': len(file_paths),
+            'sparse': sparse, 'denied': len(denied_paths)}
+
+def generate_pacman_db(root: str, packages: int, rng: random.Random):
+    db = os.path.join(root, "var/lib/pacman/local")
+    os.makedirs(db)
+    with open(os.path.join(db, "ALPM_DB_VERSION"), "w") as f:
+        f.write("9\n")
+    for i in range(packages):
+        name = f"pkg{i:05d}"
+        depends = sorted({f"pkg{rng.randrange(i):05d}>=1.0" for _ in range(rng.randrange(4))}) if i else []
+        os.makedirs(os.path.join(db, f"{name}-1.0-1"))
+        with open(os.path.join(db, f"{name}-1.0-1", "desc"), "w") as f:
+            f.write(f"%NAME%\n{name}\n\n%VERSION%\n1.0-1\n\n%SIZE%\n{rng.randrange(1, 500) * 1024 * 1024}\n\n"
+                    f"%REASON%\n{0 if rng.random() < 0.3 else 1}\n\n")
+            if depends:
+                f.write("%DEPENDS%\n" + "\n".join(depends) + "\n\n")
+
+def generate_dpkg_db(root: str, packages: int, rng: random.Random):
+    os.makedirs(os.path.join(root, "var/lib/dpkg"))
+    os.makedirs(os.path.join(root, "var/lib/apt"))
+    with open(os.path.join(root, "var/lib/dpkg/status"), "w") as status, \
+            open(os.path.join(root, "var/lib/apt/extended_states"), "w") as states:
+        for i in range(packages):
+            name = f"pkg{i:05d}"
+            depends = ", ".join(sorted({f"pkg{rng.randrange(i):05d} (>= 1.0)" for _ in range(rng.randrange(4))})) if i else ""
+            status.write(f"Package: {name}\nStatus: install ok installed\nArchitecture: amd64\nVersion: 1.0\n"
+                         f"Installed-Size: {rng.randrange(1, 500) * 1024}\n")
+            if depends:
+                status.write(f"Depends: {depends}\n")
+            status.write("Description: synthetic package\n long description line\n\n")
+            if rng.random() >= 0.3:
+                states.write(f"Package: {name}\nArchitecture: amd64\nAuto-Installed: 1\n\n")
+
+def measure(run: Callable[[Any], Any], setup: Optional[Callable[[], Any]], repeat: int, memory: bool) -> Tuple[float, Optional[int]]:
+    best = float('inf')
+    for _ in range(repeat):
+        arg = setup() if setup else None
+        gc.collect()
+        start = time.perf_counter()
+        run(arg)
+        best = min(best, time.perf_counter() - start)
+    peak = None
+    if memory:
+        # A separate traced run, since tracing slows the code down
+        arg = setup() if setup else None
+        gc.collect()
+        tracemalloc.start()
+        run(arg)
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return best, peak
+
+def build_stages(tree: str, package_root: str, workdir: str, jobs: int) -> List[Stage]:
+    from scan_utils import run_scan
+    from filter_utils import FileFilter
+    from file_utils import classify_name, classify_file
+    from package_utils import read_package_db, parse_size, removal_plan
+    from ui_utils import TreeView
+    from main import build_folder_tree
+
+    no_filter = FileFilter([])
+    index_path = os.path.join(workdir, "index.sqlite")
+    names = [name for _, _, filenames in os.walk(tree) for name in filenames]
+    results = run_scan(tree, no_filter, 'all', 100, None, jobs)
+    packages = read_package_db('arch', package_root)
+    targets = [package.name for package in packages[::50]]
+
+    def fresh_index():
+        for suffix in ("", "-wal", "-shm"):
+            if os.path.exists(index_path + suffix):
+                os.unlink(index_path + suffix)
+
+    def expand_all(root):
+        view = TreeView(root)
+        index = 0
+        while index < len(view.rows):
+            if not view.rows[index].expanded:
+                view.toggle_expand(index)
+            index += 1
+        view.toggle_select(root.children[0])
+        view.selected_nodes()
+
+    return [
+        ('scan', None, lambda _: run_scan(tree, no_filter, 'all', 4, None, jobs)),
+        ('scan_disk_usage', None, lambda _: run_scan(tree, no_filter, 'all', 4, None, jobs, True)),
+        ('scan_filtered', None, lambda _: run_scan(tree, FileFilter(['*.o', '*.log', 'l7/', 'size<16']), 'all', 4, None, jobs)),
+        ('scan_index_cold', fresh_index, lambda _: run_scan(tree, no_filter, 'all', 4, index_path, jobs)),
+        ('scan_index_warm', lambda: run_scan(tree, no_filter, 'all', 4, index_path, jobs),
+         lambda _: run_scan(tree, no_filter, 'all', 4, index_path, jobs)),
+        ('classify_name', None, lambda _: [classify_name(name) for name in names]),
+        ('classify_file_media', None, lambda _: [classify_file(name, 'media') for name in names]),
+        ('build_folder_tree', None, lambda _: build_folder_tree(results)),
+        ('tree_view', lambda: build_folder_tree(results), expand_all),
+        ('parse_size', None, lambda _: [parse_size(size) for _ in range(20000) for size in SIZE_STRINGS]),
+        ('pacman_db', None, lambda _: read_package_db('arch', package_root)),
+        ('pacman_db_cached', lambda: read_package_db('arch', package_root, os.path.join(workdir, "pacman.json")),
+         lambda _: read_package_db('arch', package_root, os.path.join(workdir, "pacman.json"))),
+        ('dpkg_db', None, lambda _: read_package_db('ubuntu', package_root)),
+        ('removal_plan', None, lambda _: removal_plan(packages, targets)),
+    ]
+
+def compare(report: Dict[str, Any], baseline: Dict[str, Any], tolerance: float) -> List[str]:
+    regressions = []
+    if baseline.get('params') != report['params']:
+        print("Warning: the baseline was recorded with different parameters")
+    print(f"\n{'stage':<22}{'seconds':>10}{'baseline':>10}{'change':>9}")
+    for name, stage in report['stages'].items():
+        before = baseline.get('stages', {}).get(name)
+        if not before:
+            print(f"{name:<22}{stage['seconds']:>10.4f}{'-':>10}{'':>9}")
+            continue
+        change = stage['seconds'] / before['seconds'] - 1 if before['seconds'] else 0.0
+        flag = ""
+        if change > tolerance:
+            flag = "  REGRESSION"
+            regressions.append(name)
+        print(f"{name:<22}{stage['seconds']:>10.4f}{before['seconds']:>10.4f}{change:>+9.1%}{flag}")
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark LinuxLaunder on synthetic trees and package databases")
+    parser.add_argument("--scale", choices=SCALES, default='small', help="Preset tree and package database size")
+    parser.add_argument("--dirs", type=int, default=None, help="Number of directories (overrides the scale)")
+    parser.add_argument("--files", type=int, default=None, help="Number of tiny files (overrides the scale)")
+    parser.add_argument("--packages", type=int, default=None, help="Number of fixture packages (overrides the scale)")
+    parser.add_argument("--layout", choices=['wide', 'deep'], default='wide', help="Few levels with many siblings, or long chains")
+    parser.add_argument("--depth", type=int, default=64, help="Chain length for the deep layout")
+    parser.add_argument("--hard-links", type=int, default=1000, help="Number of extra hard links")
+    parser.add_argument("--sparse", type=int, default=8, help="Number of 1 GB sparse files")
+    parser.add_argument("--denied", type=int, default=4, help="Number of permission-denied subtrees")
+    parser.add_argument("--seed", type=int, default=1, help="Random seed for the generated tree")
+    parser.add_argument("--jobs", "-j", type=int, default=None, help="Scanner workers (default: the scanner's default)")
+    parser.add_argument("--repeat", type=int, default=3, help="Timed runs per stage; the fastest is reported")
+    parser.add_argument("--no-memory", action="store_true", help="Skip the traced run that measures peak memory per stage")
+    parser.add_argument("--stages", nargs="+", default=None, help="Only run these stages")
+    parser.add_argument("--output", default=None, help="Write the results as JSON to this file")
+    parser.add_argument("--baseline", default=None, help="Compare against a JSON file written by --output")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="Slowdown over the baseline reported as a regression (default: 0.25)")
+    parser.add_argument("--workdir", default=None, help="Directory to create the generated data in, as a new subdirectory (default: the system temporary directory)")
+    parser.add_argument("--keep", action="store_true", help="Keep the generated data")
+    args = parser.parse_args()
+
+    set_output_mode(False, True, False)
+    from scan_utils import DEFAULT_JOBS
+    jobs = args.jobs or DEFAULT_JOBS
+    params = dict(SCALES[args.scale])
+    for key in ('dirs', 'files', 'packages'):
+        if getattr(args, key) is not None:
+            params[key] = getattr(args, key)
+    params.update(layout=args.layout, depth=args.depth, hard_links=args.hard_links, sparse=args.sparse,
+                  denied=args.denied, seed=args.seed, jobs=jobs)
+
+    # Always a new directory, so cleaning up never touches anything else
+    if args.workdir:
+        os.makedirs(args.workdir, exist_ok=True)
+    workdir = tempfile.mkdtemp(prefix="linuxlaunder-bench-", dir=args.workdir)
+    tree = os.path.join(workdir, "tree")
+    package_root = os.path.join(workdir, "packages")
+    try:
+        start = time.perf_counter()
+        generated = generate_tree(tree, params['dirs'], params['files'], args.layout, args.depth, args.hard_links,
+                                  args.sparse, args.denied, args.seed)
+        rng = random.Random(args.seed)
+        generate_pacman_db(package_root, params['packages'], rng)
+        generate_dpkg_db(package_root, params['packages'], rng)
+        print(f"Generated {generated['files']} files ({format_size(generated['bytes'])}) in {generated['dirs']} directories, "
+              f"{generated['hard_links']} hard links, {generated['sparse']} sparse files, {generated['denied']} denied "
+              f"subtrees and {params['packages']} packages in {time.perf_counter() - start:.1f}s under {workdir}")
+        if os.geteuid() == 0 and args.denied:
+            print("Note: running as root, so the permission-denied subtrees are still readable")
+
+        report: Dict[str, Any] = {'params': params, 'python': sys.version.split()[0], 'stages': {}}
+        print(f"\n{'stage':<22}{'seconds':>10}{'peak':>12}")
+        for name, setup, run in build_stages(tree, package_root, workdir, jobs):
+            if args.stages and name not in args.stages:
+                continue
+            seconds, peak = measure(run, setup, args.repeat, not args.no_memory)
+            report['stages'][name] = {'seconds': round(seconds, 6), 'peak_bytes': peak}
+            print(f"{name:<22}{seconds:>10.4f}{format_size(peak) if peak is not None else '-':>12}")
+        report['max_rss_kb'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        print(f"\nPeak RSS: {format_size(report['max_rss_kb'] * 1024)}")
+
+        if args.output:
+            with open(args.output, "w") as f:
+                json.dump(report, f, indent=2)
+                f.write("\n")
+        if args.baseline:
+            with open(args.baseline) as f:
+                regressions = compare(report, json.load(f), args.tolerance)
+            if regressions:
+                print(f"\nRegressions: {', '.join(regressions)}")
+                sys.exit(1)
+    finally:
+        if not args.keep:
+            for dirpath, dirnames, _ in os.walk(tree):
+                for dirname in dirnames:
+                    path = os.path.join(dirpath, dirname)
+                    if not os.path.islink(path):
+                        os.chmod(path, 0o755)
+            shutil.rmtree(workdir, ignore_errors=True)
+
+if __name__ == "__main__":
+    main()
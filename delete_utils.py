@@ -0,0 +1,194 @@
+import os
+import time
+import errno
+import queue
+import concurrent.futures
+from typing import Dict, Iterable, List, Tuple
+from output_utils import print_quiet, format_size
+import profile_utils
+
+DIR_FLAGS = os.O_RDONLY | os.O_DIRECTORY | os.O_NOFOLLOW | os.O_CLOEXEC
+# Files directly inside a selected folder are unlinked in batches of this size
+UNLINK_BATCH = 1024
+PROGRESS_INTERVAL = 1.0
+
+def prune_covered(paths: Iterable[str]) -> List[str]:
+    # Sorting by components puts every path right after its ancestors
+    kept = []
+    for path in sorted({os.path.normpath(p) for p in paths}, key=lambda p: p.split(os.sep)):
+        if kept and (path == kept[-1] or path.startswith(kept[-1].rstrip(os.sep) + os.sep)):
+            continue
+        kept.append(path)
+    return kept
+
+def remove_tree_at(dir_fd: int, name: str, path: str) -> Tuple[int, int]:
+    removed = errors = 0
+    try:
+        fd = os.open(name, DIR_FLAGS, dir_fd=dir_fd)
+    except OSError as e:
+        print_quiet(f"Error deleting folder {path}: {e}")
+        return 0, 1
+    try:
+        with os.scandir(fd) as entries:
+            entries = list(entries)
+        for entry in entries:
+            entry_removed, entry_errors = remove_entry_at(fd, entry.name, os.path.join(path, entry.name),
+                                                          entry.is_dir(follow_symlinks=False))
+            removed += entry_removed
+            errors += entry_errors
+    except OSError as e:
+        print_quiet(f"Error deleting folder {path}: {e}")
+        errors += 1
+    finally:
+        os.close(fd)
+    try:
+        os.rmdir(name, dir_fd=dir_fd)
+        removed += 1
+    except OSError as e:
+        print_quiet(f"Error deleting folder {path}: {e}")
+        errors += 1
+    return removed, errors
+
+def remove_entry_at(dir_fd: int, name: str, path: str, is_dir: bool = False) -> Tuple[int, int]:
+    if is_dir:
+        return remove_tree_at(dir_fd, name, path)
+    try:
+        os.unlink(name, dir_fd=dir_fd)
+        return 1, 0
+    except IsADirectoryError:
+        return remove_tree_at(dir_fd, name, path)
+    except OSError as e:
+        print_quiet(f"Error deleting file {path}: {e}")
+        return 0, 1
+
+def remove_entries_at(dir_fd: int, names: List[str], parent_path: str) -> Tuple[int, int]:
+    removed = errors = 0
+    for name in names:
+        entry_removed, entry_errors = remove_entry_at(dir_fd, name, os.path.join(parent_path, name))
+        removed += entry_removed
+        errors += entry_errors
+    return removed, errors
+
+# Removes the selected paths on a worker pool. Every unlink and rmdir is done
+# relative to an open directory descriptor, so a path component swapped for a
+# symlink mid-deletion can't redirect it outside the selection. Selected
+# folders are split into their subfolders and batches of their files, which
+# are removed in parallel; the folder itself is removed once all are done.
+def delete_items(items: Iterable[Tuple[str, int, int]], jobs: int, dry_run: bool = False) -> Tuple[int, int]:
+    with profile_utils.phase("dry_run" if dry_run else "delete"):
+        reclaimed_bytes, reclaimed_count = remove_items(items, jobs, dry_run)
+    if not dry_run:
+        profile_utils.count("deleted_bytes", reclaimed_bytes)
+        profile_utils.count("deleted_entries", reclaimed_count)
+    return reclaimed_bytes, reclaimed_count
+
+def remove_items(items: Iterable[Tuple[str, int, int]], jobs: int, dry_run: bool = False) -> Tuple[int, int]:
+    sizes: Dict[str, Tuple[int, int]] = {os.path.normpath(path): (size, count) for path, size, count in items}
+    paths = prune_covered(sizes)
+    total_bytes = sum(sizes[path][0] for path in paths)
+    total_count = sum(sizes[path][1] for path in paths)
+
+    if dry_run:
+        for path in paths:
+            size, count = sizes[path]
+            print_quiet(f"Would delete {path}: {format_size(size)} in {count} entries")
+        print_quiet(f"Dry run: {format_size(total_bytes)} in {total_count} entries would be reclaimed")
+        return total_bytes, total_count
+
+    finished = queue.SimpleQueue()
+    parent_fds: Dict[str, int] = {}
+    # path -> [parent_fd, own_fd, unfinished_tasks, errors]
+    pending: Dict[str, List[int]] = {}
+    removed = outstanding = 0
+    reclaimed_bytes = reclaimed_count = 0
+
+    def parent_fd_for(path: str) -> int:
+        # A relative top-level path such as "sel" has no directory part
+        parent = os.path.dirname(path) or os.curdir
+        if parent not in parent_fds:
+            parent_fds[parent] = os.open(parent, DIR_FLAGS)
+        return parent_fds[parent]
+
+    def finish(path: str, errors: int, is_dir: bool):
+        nonlocal reclaimed_bytes, reclaimed_count
+        profile_utils.count("delete_errors", errors)
+        if not errors:
+            reclaimed_bytes += sizes[path][0]
+            reclaimed_count += sizes[path][1]
+            print_quiet(f"Deleted {'folder' if is_dir else 'file'}: {path}")
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, jobs)) as pool:
+        def submit(path, fn, *args):
+            nonlocal outstanding
+            future = pool.submit(fn, *args)
+            future.add_done_callback(lambda f: finished.put((path, f)))
+            outstanding += 1
+
+        for path in paths:
+            name = os.path.basename(path)
+            try:
+                dir_fd = parent_fd_for(path)
+            except OSError as e:
+                print_quiet(f"Error deleting {path}: {e}")
+                continue
+            try:
+                fd = os.open(name, DIR_FLAGS, dir_fd=dir_fd)
+            except OSError as e:
+                # Files and symlinks are unlinked instead, which needs no extra stat
+                if e.errno in (errno.ENOTDIR, errno.ELOOP):
+                    submit(path, remove_entry_at, dir_fd, name, path)
+                else:
+                    print_quiet(f"Error deleting {path}: {e}")
+                continue
+
+            pending[path] = [dir_fd, fd, 0, 0]
+            try:
+                with os.scandir(fd) as entries:
+                    files = []
+                    for entry in entries:
+                        if entry.is_dir(follow_symlinks=False):
+                            pending[path][2] += 1
+                            submit(path, remove_tree_at, fd, entry.name, os.path.join(path, entry.name))
+                        else:
+                            files.append(entry.name)
+                for start in range(0, len(files), UNLINK_BATCH):
+                    pending[path][2] += 1
+                    submit(path, remove_entries_at, fd, files[start:start + UNLINK_BATCH], path)
+            except OSError as e:
+                print_quiet(f"Error deleting folder {path}: {e}")
+                pending[path][3] += 1
+            if not pending[path][2]:
+                outstanding += 1
+                finished.put((path, None))
+
+        last_progress = time.time()
+        while outstanding:
+            path, future = finished.get()
+            outstanding -= 1
+            task_removed, task_errors = future.result() if future else (0, 0)
+            removed += task_removed
+            if path not in pending:
+                finish(path, task_errors, False)
+            else:
+                state = pending[path]
+                state[3] += task_errors
+                if future:
+                    state[2] -= 1
+                if not state[2]:
+                    del pending[path]
+                    os.close(state[1])
+                    try:
+                        os.rmdir(os.path.basename(path), dir_fd=state[0])
+                        removed += 1
+                    except OSError as e:
+                        print_quiet(f"Error deleting folder {path}: {e}")
+                        state[3] += 1
+                    finish(path, state[3], True)
+            if time.time() - last_progress >= PROGRESS_INTERVAL:
+                last_progress = time.time()
+                print_quiet(f"Deleting... {removed} entries removed")
+
+    for fd in parent_fds.values():
+        os.close(fd)
+    print_quiet(f"Reclaimed {format_size(reclaimed_bytes)} in {reclaimed_count} entries ({removed} entries removed)")
+    return reclaimed_bytes, reclaimed_count
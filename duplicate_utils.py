@@ -0,0 +1,102 @@
+import os
+import mmap
+import hashlib
+import concurrent.futures
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from output_utils import print_verbose, format_size
+
+# Bytes hashed at each end of a file before committing to a full read. Files
+# up to twice this size are fully covered by the partial hash.
+EDGE_BLOCK = 64 * 1024
+READ_CHUNK = 1024 * 1024
+MMAP_CHUNK = 16 * 1024 * 1024
+
+# (apparent size, [(path, item)]) of files that may share the same content
+Group = Tuple[int, List[Tuple[str, Any]]]
+
+# Keyed on the size found now, so a file that changed length since the scan
+# can't match its old peers, or be taken as covered by the edge blocks.
+def edge_hash(path: str) -> Optional[Tuple[int, bytes]]:
+    try:
+        fd = os.open(path, os.O_RDONLY | os.O_CLOEXEC)
+    except OSError:
+        return None
+    try:
+        size = os.fstat(fd).st_size
+        digest = hashlib.blake2b(os.pread(fd, EDGE_BLOCK, 0), digest_size=16)
+        if size > EDGE_BLOCK:
+            digest.update(os.pread(fd, EDGE_BLOCK, max(EDGE_BLOCK, size - EDGE_BLOCK)))
+        return size, digest.digest()
+    except OSError:
+        return None
+    finally:
+        os.close(fd)
+
+def full_hash(path: str) -> Optional[bytes]:
+    digest = hashlib.blake2b(digest_size=32)
+    try:
+        with open(path, 'rb', buffering=0) as f:
+            try:
+                mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except (ValueError, OSError):
+                # Empty files and filesystems without mmap support
+                mapped = None
+            if mapped is not None:
+                with mapped:
+                    if hasattr(mmap, 'MADV_SEQUENTIAL'):
+                        mapped.madvise(mmap.MADV_SEQUENTIAL)
+                    with memoryview(mapped) as view:
+                        for start in range(0, len(view), MMAP_CHUNK):
+                            digest.update(view[start:start + MMAP_CHUNK])
+            else:
+                buffer = bytearray(READ_CHUNK)
+                with memoryview(buffer) as view:
+                    while True:
+                        read = f.readinto(buffer)
+                        if not read:
+                            break
+                        digest.update(view[:read])
+    except OSError:
+        return None
+    return digest.digest()
+
+# Splits groups by hash_file's result, returned with each new group
+def refine(groups: List[Group], hash_file: Callable[[str], Optional[Any]], pool: concurrent.futures.Executor, chunksize: int) -> List[Tuple[Group, Any]]:
+    paths = [path for _, members in groups for path, _ in members]
+    digests = iter(pool.map(hash_file, paths, chunksize=chunksize))
+    refined = []
+    for size, members in groups:
+        by_digest: Dict[Any, List[Tuple[str, Any]]] = {}
+        for member in members:
+            digest = next(digests)
+            if digest is not None:
+                by_digest.setdefault(digest, []).append(member)
+        refined.extend(((size, same), digest) for digest, same in by_digest.items() if len(same) > 1)
+    return refined
+
+# Narrows files of equal size down to groups of identical content. Each stage
+# only reads the files that survived the previous one: sizes come from the
+# scan, then the first and last blocks are hashed, then the whole file.
+# Hashing runs on a process pool so large files are digested on every core.
+def find_duplicates(by_size: Dict[int, List[Tuple[str, Any]]], workers: int, item_size: Optional[Callable[[Any], int]] = None) -> List[List[Any]]:
+    candidates = sum(len(members) for members in by_size.values())
+    groups = [(size, members) for size, members in by_size.items() if len(members) > 1]
+    print_verbose(f"Duplicates: {candidates} candidates, {sum(len(m) for _, m in groups)} share a size")
+    if not groups:
+        return []
+
+    with concurrent.futures.ProcessPoolExecutor(max_workers=max(1, workers)) as pool:
+        edge_groups = refine(groups, edge_hash, pool, 64)
+        print_verbose(f"Duplicates: {sum(len(m) for (_, m), _ in edge_groups)} share their first and last blocks")
+        # Coverage depends on the apparent size, never on the allocated one
+        covered = [group for group, (apparent, _) in edge_groups if apparent <= 2 * EDGE_BLOCK]
+        large = [(group, apparent) for group, (apparent, _) in edge_groups if apparent > 2 * EDGE_BLOCK]
+        print_verbose(f"Duplicates: fully hashing {sum(len(m) for (_, m), _ in large)} files "
+                      f"({format_size(sum(apparent * len(m) for (_, m), apparent in large))})")
+        groups = covered + [group for group, _ in refine([group for group, _ in large], full_hash, pool, 1)]
+
+    # Largest reclaimable space first, by item_size (the allocated size with
+    # --disk-usage) when given; copies in path order
+    groups.sort(key=lambda group: (item_size(group[1][0][1]) if item_size else group[0]) * (len(group[1]) - 1),
+                reverse=True)
+    return [[item for _, item in sorted(members, key=lambda member: member[0])] for _, members in groups]
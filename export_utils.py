@@ -0,0 +1,72 @@
+import sys
+import csv
+import json
+import socket
+from typing import Iterable, List, Optional
+from result_utils import ScanResults, TYPE_NAMES
+
+EXPORT_FORMATS = ['ndjson', 'csv']
+FIELDS = ['host', 'kind', 'path', 'size', 'type', 'count', 'group']
+# Buffered text is written out once it reaches this size, so memory stays
+# bounded and consumers see records while the scan is still running.
+BUFFER_BYTES = 64 * 1024
+
+# One record per line, sizes in bytes. Every record carries the host name so
+# the output of many machines can be concatenated and aggregated as is.
+class RecordWriter:
+    def __init__(self, fmt: str, path: Optional[str] = None):
+        self.format = fmt
+        self.host = socket.gethostname()
+        self.records = 0
+        self._buffer: List[str] = []
+        self._buffered = 0
+        # Paths that aren't valid UTF-8 are written back as their original
+        # bytes, in both formats, so they name the same files on the host
+        if path:
+            self._file = open(path, "w", newline="", encoding="utf-8", errors="surrogateescape")
+        else:
+            self._file = sys.stdout
+            self._file.reconfigure(errors="surrogateescape")
+        self._csv = csv.writer(self, lineterminator="\n") if fmt == 'csv' else None
+        if self._csv:
+            self._csv.writerow(FIELDS)
+
+    def write(self, text: str):
+        self._buffer.append(text)
+        self._buffered += len(text)
+        if self._buffered >= BUFFER_BYTES:
+            self.flush()
+
+    def record(self, kind: str, path: str, size: int, item_type: str, count: Optional[int] = None, group: Optional[int] = None):
+        self.records += 1
+        if self._csv:
+            self._csv.writerow([self.host, kind, path, size, item_type, count, group])
+        else:
+            self.write(json.dumps({'host': self.host, 'kind': kind, 'path': path, 'size': size, 'type': item_type,
+                                   'count': count, 'group': group}, separators=(',', ':'), ensure_ascii=False) + "\n")
+
+    def flush(self):
+        self._file.write("".join(self._buffer))
+        self._file.flush()
+        self._buffer = []
+        self._buffered = 0
+
+    def close(self):
+        self.flush()
+        if self._file is not sys.stdout:
+            self._file.close()
+
+# Writes what the scan didn't stream: files and folders when only the top N
+# were kept, duplicate groups (known only once the scan is done) and packages.
+def export_results(export: RecordWriter, results: ScanResults, packages: Optional[Iterable[tuple]], threshold: int, streamed: bool):
+    if not streamed:
+        for index in results.file_order:
+            export.record('file', results.path(index), results.sizes[index], TYPE_NAMES[results.types[index]])
+        for index in results.folder_order:
+            export.record('folder', results.path(index), results.sizes[index], 'folder', results.counts[index])
+    for group, files in enumerate(results.duplicate_groups()):
+        for path, size, file_type in files:
+            export.record('duplicate', path, size, file_type, group=group)
+    for package in packages or ():
+        if package.size > threshold:
+            export.record('package', package.name, package.size, 'explicit' if package.explicit else 'dependency')
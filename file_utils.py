@@ -1,4 +1,6 @@
 import os
+import re
+from typing import Dict, Iterable, List, Optional, Pattern, Set, Tuple
 from functools import lru_cache
 from output_utils import print_verbose, print_quiet
 
@@ -9,29 +11,172 @@ def get_file_size(file_path: str) -> int:
     except OSError:
         return 0
 
+# Categories in the priority order used by the 'all' scan type. Each category
+# owns one bit of the mask returned by classify_name.
+FILE_CATEGORIES = ['media', 'document', 'archive', 'temporary', 'package', 'malicious']
+CATEGORY_BITS = {category: 1 << i for i, category in enumerate(FILE_CATEGORIES)}
+
+CATEGORY_SUFFIXES = {
+    'media': {'.mp3', '.mp4', '.avi', '.mov', '.jpg', '.jpeg', '.png', '.gif', '.wav', '.flac', '.mkv'},
+    'document': {'.pdf', '.doc', '.docx', '.txt', '.rtf', '.odt', '.xls', '.xlsx', '.ppt', '.pptx'},
+    'archive': {'.zip', '.rar', '.7z', '.tar', '.gz', '.bz2'},
+    'package': {'.deb', '.rpm', '.tar.gz', '.apk'},
+    'malicious': {'.exe', '.bat', '.sh', '.vbs', '.js'},
+}
+CATEGORY_PATTERNS = {
+    'temporary': {'.tmp', '.temp', '~', '.bak', '.swp'},
+}
+
+def compile_suffix_table(category_suffixes: Dict[str, Set[str]]) -> Dict[str, int]:
+    table: Dict[str, int] = {}
+    for category, suffixes in category_suffixes.items():
+        for suffix in suffixes:
+            table[suffix] = table.get(suffix, 0) | CATEGORY_BITS[category]
+    return table
+
+def compile_pattern_table(category_patterns: Dict[str, Set[str]]) -> List[Tuple[Pattern, int]]:
+    return [(re.compile('|'.join(re.escape(p) for p in sorted(patterns))), CATEGORY_BITS[category])
+            for category, patterns in category_patterns.items()]
+
+SUFFIX_TABLE = compile_suffix_table(CATEGORY_SUFFIXES)
+PATTERN_TABLE = compile_pattern_table(CATEGORY_PATTERNS)
+MAX_SUFFIX_PARTS = max(suffix.count('.') for suffix in SUFFIX_TABLE)
+
+# Magic numbers matched by --sniff: (offset, magic, kind). Only the first
+# SNIFF_BYTES of a file are read, plus one small read for signatures that
+# live further in (ISO 9660).
+SNIFF_BYTES = 4096
+SIGNATURES = [
+    (0, b'\x7fELF', 'elf'),
+    (0, b'MZ', 'pe'),
+    (0, b'PK\x03\x04', 'zip'),
+    (0, b'PK\x05\x06', 'zip'),
+    (0, b'\x1f\x8b', 'gzip'),
+    (0, b'\xfd7zXZ\x00', 'xz'),
+    (0, b'\x28\xb5\x2f\xfd', 'zstd'),
+    (0, b'BZh', 'bzip2'),
+    (0, b"7z\xbc\xaf'\x1c", '7z'),
+    (0, b'Rar!\x1a\x07', 'rar'),
+    (257, b'ustar', 'tar'),
+    (0, b'!<arch>\ndebian', 'deb'),
+    (0, b'\xed\xab\xee\xdb', 'rpm'),
+    (0, b'%PDF-', 'pdf'),
+    (0, b'\xff\xd8\xff', 'jpeg'),
+    (0, b'\x89PNG\r\n\x1a\n', 'png'),
+    (0, b'GIF8', 'gif'),
+    (4, b'ftyp', 'mp4'),
+    (0, b'\x1a\x45\xdf\xa3', 'matroska'),
+    (0, b'RIFF', 'riff'),
+    (0, b'fLaC', 'flac'),
+    (0, b'OggS', 'ogg'),
+    (0, b'ID3', 'mp3'),
+    (32769, b'CD001', 'iso'),
+]
+# Category each kind implies, and the categories a file name may claim without
+# contradicting its content (a .docx is a zip, a .tar.gz is gzip).
+SIGNATURE_KINDS = {
+    'elf': ('malicious', {'malicious', 'package'}),
+    'pe': ('malicious', {'malicious', 'package'}),
+    'zip': ('archive', {'archive', 'document', 'package'}),
+    'gzip': ('archive', {'archive', 'package'}),
+    'xz': ('archive', {'archive', 'package'}),
+    'zstd': ('archive', {'archive', 'package'}),
+    'bzip2': ('archive', {'archive', 'package'}),
+    '7z': ('archive', {'archive'}),
+    'rar': ('archive', {'archive'}),
+    'tar': ('archive', {'archive', 'package'}),
+    'iso': ('archive', {'archive', 'package'}),
+    'deb': ('package', {'package', 'archive'}),
+    'rpm': ('package', {'package'}),
+    'pdf': ('document', {'document'}),
+    'jpeg': ('media', {'media'}),
+    'png': ('media', {'media'}),
+    'gif': ('media', {'media'}),
+    'mp4': ('media', {'media'}),
+    'matroska': ('media', {'media'}),
+    'riff': ('media', {'media'}),
+    'flac': ('media', {'media'}),
+    'ogg': ('media', {'media'}),
+    'mp3': ('media', {'media'}),
+}
+SIGNATURE_MASKS = {kind: (CATEGORY_BITS[category], sum(CATEGORY_BITS[c] for c in compatible))
+                   for kind, (category, compatible) in SIGNATURE_KINDS.items()}
+
+def sniff_file(file_path: str) -> Optional[str]:
+    # Returns the signature kind, '' if nothing matched, or None if unreadable
+    try:
+        fd = os.open(file_path, os.O_RDONLY | os.O_NOFOLLOW | os.O_NONBLOCK | os.O_CLOEXEC)
+    except OSError:
+        return None
+    try:
+        header = os.pread(fd, SNIFF_BYTES, 0)
+        for offset, magic, kind in SIGNATURES:
+            end = offset + len(magic)
+            if end <= SNIFF_BYTES:
+                if header[offset:end] == magic:
+                    return kind
+            elif len(header) == SNIFF_BYTES and os.pread(fd, len(magic), offset) == magic:
+                return kind
+        return ''
+    except OSError:
+        return None
+    finally:
+        os.close(fd)
+
+def sniffed_mask(name_mask: int, kind: Optional[str]) -> int:
+    # The name is trusted unless the content says otherwise
+    if kind not in SIGNATURE_MASKS:
+        return name_mask
+    category_bit, compatible = SIGNATURE_MASKS[kind]
+    return name_mask if name_mask & compatible else category_bit
+
+def classify_name(name: str) -> int:
+    lowered = name.lower()
+    mask = 0
+    for pattern, bit in PATTERN_TABLE:
+        if pattern.search(lowered):
+            mask |= bit
+    # Leading dots belong to the name, as with os.path.splitext.
+    start = len(lowered) - len(lowered.lstrip('.'))
+    dot = len(lowered)
+    for _ in range(MAX_SUFFIX_PARTS):
+        dot = lowered.rfind('.', start + 1, dot)
+        if dot < 0:
+            break
+        mask |= SUFFIX_TABLE.get(lowered[dot:], 0)
+    return mask
+
+def category_from_mask(mask: int, scan_type: str) -> str:
+    # Duplicate scans keep every file and only label it with its category
+    if scan_type in ('all', 'duplicate'):
+        if not mask:
+            return 'other'
+        return FILE_CATEGORIES[(mask & -mask).bit_length() - 1]
+    return scan_type if mask & CATEGORY_BITS.get(scan_type, 0) else 'other'
+
+def classify_file(name: str, scan_type: str) -> str:
+    return category_from_mask(classify_name(name), scan_type)
+
+def classify_entries(entries: Iterable[os.DirEntry], scan_type: str) -> List[Tuple[os.DirEntry, str]]:
+    return [(entry, category_from_mask(classify_name(entry.name), scan_type)) for entry in entries]
+
 def is_media_file(file_path: str) -> bool:
-    media_extensions = {'.mp3', '.mp4', '.avi', '.mov', '.jpg', '.jpeg', '.png', '.gif', '.wav', '.flac', '.mkv'}
-    return os.path.splitext(file_path)[1].lower() in media_extensions
+    return bool(classify_name(os.path.basename(file_path)) & CATEGORY_BITS['media'])
 
 def is_document_file(file_path: str) -> bool:
-    document_extensions = {'.pdf', '.doc', '.docx', '.txt', '.rtf', '.odt', '.xls', '.xlsx', '.ppt', '.pptx'}
-    return os.path.splitext(file_path)[1].lower() in document_extensions
+    return bool(classify_name(os.path.basename(file_path)) & CATEGORY_BITS['document'])
 
 def is_archive_file(file_path: str) -> bool:
-    archive_extensions = {'.zip', '.rar', '.7z', '.tar', '.gz', '.bz2'}
-    return os.path.splitext(file_path)[1].lower() in archive_extensions
+    return bool(classify_name(os.path.basename(file_path)) & CATEGORY_BITS['archive'])
 
 def is_temporary_file(file_path: str) -> bool:
-    temp_patterns = {'.tmp', '.temp', '~', '.bak', '.swp'}
-    return any(pattern in os.path.basename(file_path).lower() for pattern in temp_patterns)
+    return bool(classify_name(os.path.basename(file_path)) & CATEGORY_BITS['temporary'])
 
 def is_package_file(file_path: str) -> bool:
-    package_extensions = {'.deb', '.rpm', '.tar.gz', '.apk'}
-    return os.path.splitext(file_path)[1].lower() in package_extensions
+    return bool(classify_name(os.path.basename(file_path)) & CATEGORY_BITS['package'])
 
 def is_potentially_malicious(file_path: str) -> bool:
-    suspicious_extensions = {'.exe', '.bat', '.sh', '.vbs', '.js'}
-    return os.path.splitext(file_path)[1].lower() in suspicious_extensions
+    return bool(classify_name(os.path.basename(file_path)) & CATEGORY_BITS['malicious'])
 
 def remove_file(file_path: str):
     try:
@@ -0,0 +1,188 @@
+import os
+import re
+import pwd
+import time
+import hashlib
+import operator
+from typing import Callable, List, Optional, Pattern, Set, Tuple
+from output_utils import print_verbose
+
+PREDICATE = re.compile(r'^(size|age|owner)\s*(<=|>=|!=|<|>|=)\s*(\S+)$')
+OPERATORS = {'<': operator.lt, '<=': operator.le, '>': operator.gt, '>=': operator.ge,
+             '=': operator.eq, '!=': operator.ne}
+# age > N is mtime < now - N, so age comparisons flip when turned into mtimes
+FLIPPED = {'<': '>', '<=': '>=', '>': '<', '>=': '<=', '=': '=', '!=': '!='}
+SIZE_UNITS = {'': 1, 'k': 1024, 'm': 1024 ** 2, 'g': 1024 ** 3, 't': 1024 ** 4}
+AGE_UNITS = {'s': 1, 'min': 60, 'h': 3600, 'd': 86400, 'w': 7 * 86400, 'y': 365 * 86400}
+GLOB_CHARS = re.compile(r'[*?\[\\]')
+
+def translate_glob(pattern: str) -> str:
+    # gitignore globs: '*' and '?' stop at '/', '**' crosses directories
+    out = []
+    i, n = 0, len(pattern)
+    while i < n:
+        c = pattern[i]
+        if c == '*':
+            if pattern.startswith('**', i):
+                i += 2
+                if i < n and pattern[i] == '/':
+                    out.append('(?:.*/)?')
+                    i += 1
+                else:
+                    out.append('.*')
+                continue
+            out.append('[^/]*')
+        elif c == '?':
+            out.append('[^/]')
+        elif c == '[':
+            # A ']' right after '[' or '[!' is part of the set, not its end
+            start = i + 3 if pattern[i + 1:i + 2] in ('!', '^') else i + 2
+            end = pattern.find(']', start)
+            if end < 0:
+                out.append(re.escape(c))
+            else:
+                body = pattern[i + 1:end]
+                if body[0] in '!^':
+                    body = '^' + body[1:]
+                out.append('[' + body.replace('\\', '\\\\') + ']')
+                i = end
+        elif c == '\\' and i + 1 < n:
+            i += 1
+            out.append(re.escape(pattern[i]))
+        else:
+            out.append(re.escape(c))
+        i += 1
+    return ''.join(out)
+
+def escape_name(name: str) -> str:
+    # A literal entry name as a rule that matches only that name
+    escaped = GLOB_CHARS.sub(lambda m: '\\' + m.group(0), name)
+    return '\\' + escaped if escaped[:1] in ('!', '#') else escaped
+
+def parse_size_value(value: str) -> int:
+    match = re.fullmatch(r'(\d+(?:\.\d+)?)\s*([kmgt]?)(?:i?b)?', value.lower())
+    if not match:
+        raise ValueError(f"Invalid size: {value}")
+    return int(float(match.group(1)) * SIZE_UNITS[match.group(2)])
+
+def parse_age_value(value: str) -> int:
+    match = re.fullmatch(r'(\d+(?:\.\d+)?)\s*(s|min|h|d|w|y)?', value.lower())
+    if not match:
+        raise ValueError(f"Invalid age: {value}")
+    return int(float(match.group(1)) * AGE_UNITS[match.group(2) or 'd'])
+
+def parse_owner_value(value: str) -> int:
+    if value.isdigit():
+        return int(value)
+    try:
+        return pwd.getpwnam(value).pw_uid
+    except KeyError:
+        raise ValueError(f"Unknown user: {value}")
+
+# Path rules and stat predicates compiled once, then matched against every
+# entry the walker lists. Path rules follow .gitignore: the last matching rule
+# wins, '!' re-includes, a trailing '/' only matches directories, and a rule
+# with a '/' in it is anchored at the scanned directory. size, age and owner
+# predicates exclude the files (not directories) they match.
+class FileFilter:
+    def __init__(self, rules: List[str], now: Optional[float] = None):
+        self.rules = [rule for rule in (line.rstrip() for line in rules) if rule and not rule.startswith('#')]
+        now = time.time() if now is None else now
+        self.predicates: List[Tuple[str, Callable[[int, int], bool], int]] = []
+        # ((regex, negated, dir_only), plain name or None)
+        path_rules: List[Tuple[Tuple[str, bool, bool], Optional[str]]] = []
+        has_age = False
+        # Anchored rules match paths relative to the scanned directory, so
+        # their results depend on where the scan started
+        self.anchored = False
+
+        for rule in self.rules:
+            match = PREDICATE.match(rule)
+            if match:
+                field, op, value = match.groups()
+                if field == 'size':
+                    self.predicates.append(('st_size', OPERATORS[op], parse_size_value(value)))
+                elif field == 'age':
+                    has_age = True
+                    self.predicates.append(('st_mtime', OPERATORS[FLIPPED[op]], now - parse_age_value(value)))
+                elif op in ('=', '!='):
+                    self.predicates.append(('st_uid', OPERATORS[op], parse_owner_value(value)))
+                else:
+                    raise ValueError(f"Invalid owner rule: {rule}")
+                continue
+            source = rule
+            negated = rule.startswith('!')
+            if negated:
+                rule = rule[1:]
+            dir_only = rule.endswith('/')
+            rule = rule.rstrip('/')
+            anchored = '/' in rule
+            self.anchored = self.anchored or anchored
+            regex = ('' if anchored else '(?:.*/)?') + translate_glob(rule.lstrip('/'))
+            try:
+                re.compile(regex)
+            except re.error as e:
+                raise ValueError(f"Invalid rule: {source}: {e.msg}")
+            plain_name = None if anchored or GLOB_CHARS.search(rule) else rule
+            path_rules.append(((regex, negated, dir_only), plain_name))
+
+        # Without '!' rules any match excludes, so plain names can be looked up
+        # in a set. With them, every rule goes through the ordered regex.
+        any_negated = any(negated for (_, negated, _), _ in path_rules)
+        self.dir_names, self.dir_regex, self.dir_negated = self.compile(
+            path_rules, any_negated, include_dir_only=True)
+        self.file_names, self.file_regex, self.file_negated = self.compile(
+            path_rules, any_negated, include_dir_only=False)
+
+        # Index records depend on the rules, and on the day when ages are used
+        key = '\n'.join(self.rules) + (f'\n{int(now // 86400)}' if has_age else '')
+        self.key = hashlib.sha1(key.encode()).hexdigest() if self.rules else ''
+
+    @staticmethod
+    def compile(path_rules, any_negated: bool, include_dir_only: bool) -> Tuple[Set[str], Optional[Pattern], List[bool]]:
+        names: Set[str] = set()
+        patterns: List[str] = []
+        negated_flags: List[bool] = []
+        # Reversed, so the first alternative that matches is the last rule
+        for (regex, negated, dir_only), name in reversed(path_rules):
+            if dir_only and not include_dir_only:
+                continue
+            if name is not None and not any_negated:
+                names.add(name)
+                continue
+            patterns.append(f'({regex})')
+            negated_flags.append(negated)
+        return names, re.compile('|'.join(patterns), re.DOTALL) if patterns else None, negated_flags
+
+    def __bool__(self) -> bool:
+        return bool(self.rules)
+
+    def excludes_dir(self, rel_path: str, name: str) -> bool:
+        if name in self.dir_names:
+            return True
+        match = self.dir_regex.fullmatch(rel_path) if self.dir_regex else None
+        return match is not None and not self.dir_negated[match.lastindex - 1]
+
+    def excludes_path(self, rel_path: str, name: str) -> bool:
+        if name in self.file_names:
+            return True
+        match = self.file_regex.fullmatch(rel_path) if self.file_regex else None
+        return match is not None and not self.file_negated[match.lastindex - 1]
+
+    def excludes_stat(self, st: os.stat_result) -> bool:
+        for field, op, value in self.predicates:
+            if op(getattr(st, field), value):
+                return True
+        return False
+
+def load_rules(path: str) -> List[str]:
+    with open(path, encoding="utf-8", errors="replace") as f:
+        return f.read().splitlines()
+
+def build_filter(ignore_rules: List[str], rule_files: List[str]) -> FileFilter:
+    rules = list(ignore_rules)
+    for path in rule_files:
+        rules.extend(load_rules(path))
+    file_filter = FileFilter(rules)
+    print_verbose(f"Filter: {len(file_filter.rules)} rules, {len(file_filter.predicates)} predicates")
+    return file_filter
@@ -0,0 +1,160 @@
+import os
+import time
+import marshal
+import sqlite3
+import threading
+from typing import Any, List, Optional, Tuple
+from output_utils import print_verbose
+
+INDEX_VERSION = 6
+FLUSH_EVERY = 10000
+# Rows not seen by any scan for this long belong to directories and files that
+# were deleted or are no longer scanned, and are evicted when an index closes.
+EVICT_AFTER = 30 * 86400
+# A reused row's last-seen time is only rewritten once it is this old
+TOUCH_AFTER = 86400
+# Directories modified this close to the scan may change again within the same
+# mtime tick, so they are never trusted from the index.
+RACY_WINDOW_NS = 2 * 1000 * 1000 * 1000
+
+def default_index_path() -> str:
+    cache_home = os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+    return os.path.join(cache_home, "linuxlaunder", "index.sqlite")
+
+class ScanIndex:
+    def __init__(self, path: str, params: str):
+        self.path = path
+        self.params = params
+        self.started_ns = time.time_ns()
+        self.now = self.started_ns // 1000000000
+        self._local = threading.local()
+        self._connections: List[sqlite3.Connection] = []
+        self._pending: List[Tuple[int, int, str, int, bytes, int]] = []
+        self._pending_signatures: List[Tuple[int, int, int, int, str, int]] = []
+        self._touched: List[Tuple[int, int, int, str]] = []
+        self._touched_signatures: List[Tuple[int, int, int]] = []
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        conn = self._connection()
+        if conn.execute("PRAGMA user_version").fetchone()[0] != INDEX_VERSION:
+            conn.execute("DROP TABLE IF EXISTS dirs")
+            conn.execute("DROP TABLE IF EXISTS signatures")
+            conn.execute(f"PRAGMA user_version = {INDEX_VERSION}")
+        conn.execute("CREATE TABLE IF NOT EXISTS dirs ("
+                     "dev INTEGER, ino INTEGER, params TEXT, mtime_ns INTEGER, record BLOB, seen INTEGER, "
+                     "PRIMARY KEY (dev, ino, params)) WITHOUT ROWID")
+        # Content signatures of sniffed files, valid while mtime and size match
+        conn.execute("CREATE TABLE IF NOT EXISTS signatures ("
+                     "dev INTEGER, ino INTEGER, mtime_ns INTEGER, size INTEGER, kind TEXT, seen INTEGER, "
+                     "PRIMARY KEY (dev, ino)) WITHOUT ROWID")
+        conn.execute("CREATE INDEX IF NOT EXISTS dirs_seen ON dirs (seen)")
+        conn.execute("CREATE INDEX IF NOT EXISTS signatures_seen ON signatures (seen)")
+        conn.commit()
+
+    def _connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            self._connections.append(conn)
+        return conn
+
+    def lookup(self, dir_stat: os.stat_result) -> Optional[Any]:
+        try:
+            row = self._connection().execute(
+                "SELECT mtime_ns, record, seen FROM dirs WHERE dev = ? AND ino = ? AND params = ?",
+                (dir_stat.st_dev, dir_stat.st_ino, self.params)).fetchone()
+        except sqlite3.Error:
+            row = None
+        if row is None or row[0] != dir_stat.st_mtime_ns:
+            return None
+        if row[2] < self.now - TOUCH_AFTER:
+            self._touched.append((self.now, dir_stat.st_dev, dir_stat.st_ino, self.params))
+            if len(self._touched) >= FLUSH_EVERY:
+                self.flush()
+        try:
+            return marshal.loads(row[1])
+        except (EOFError, ValueError, TypeError):
+            return None
+
+    def store(self, dir_stat: os.stat_result, record: Any):
+        if dir_stat.st_mtime_ns >= self.started_ns - RACY_WINDOW_NS:
+            return
+        self._pending.append((dir_stat.st_dev, dir_stat.st_ino, self.params,
+                              dir_stat.st_mtime_ns, marshal.dumps(record), self.now))
+        if len(self._pending) >= FLUSH_EVERY:
+            self.flush()
+
+    def lookup_signature(self, file_stat: os.stat_result) -> Optional[str]:
+        try:
+            row = self._connection().execute(
+                "SELECT mtime_ns, size, kind, seen FROM signatures WHERE dev = ? AND ino = ?",
+                (file_stat.st_dev, file_stat.st_ino)).fetchone()
+        except sqlite3.Error:
+            row = None
+        if row is None or row[0] != file_stat.st_mtime_ns or row[1] != file_stat.st_size:
+            return None
+        if row[3] < self.now - TOUCH_AFTER:
+            self._touched_signatures.append((self.now, file_stat.st_dev, file_stat.st_ino))
+            if len(self._touched_signatures) >= FLUSH_EVERY:
+                self.flush()
+        return row[2]
+
+    def store_signature(self, file_stat: os.stat_result, kind: str):
+        if file_stat.st_mtime_ns >= self.started_ns - RACY_WINDOW_NS:
+            return
+        self._pending_signatures.append((file_stat.st_dev, file_stat.st_ino, file_stat.st_mtime_ns,
+                                         file_stat.st_size, kind, self.now))
+        if len(self._pending_signatures) >= FLUSH_EVERY:
+            self.flush()
+
+    def flush(self):
+        # Lookups on worker threads may flush too, so each flush takes the
+        # pending rows out before writing them
+        pending, self._pending = self._pending, []
+        pending_signatures, self._pending_signatures = self._pending_signatures, []
+        touched, self._touched = self._touched, []
+        touched_signatures, self._touched_signatures = self._touched_signatures, []
+        if not (pending or pending_signatures or touched or touched_signatures):
+            return
+        conn = self._connection()
+        try:
+            with conn:
+                conn.executemany("INSERT OR REPLACE INTO dirs VALUES (?, ?, ?, ?, ?, ?)", pending)
+                conn.executemany("INSERT OR REPLACE INTO signatures VALUES (?, ?, ?, ?, ?, ?)", pending_signatures)
+                conn.executemany("UPDATE dirs SET seen = ? WHERE dev = ? AND ino = ? AND params = ?", touched)
+                conn.executemany("UPDATE signatures SET seen = ? WHERE dev = ? AND ino = ?", touched_signatures)
+        except sqlite3.Error as e:
+            print_verbose(f"Error writing scan index {self.path}: {e}")
+
+    def evict(self) -> int:
+        conn = self._connection()
+        try:
+            with conn:
+                evicted = conn.execute("DELETE FROM dirs WHERE seen < ?", (self.now - EVICT_AFTER,)).rowcount
+                evicted += conn.execute("DELETE FROM signatures WHERE seen < ?", (self.now - EVICT_AFTER,)).rowcount
+        except sqlite3.Error as e:
+            print_verbose(f"Error evicting from scan index {self.path}: {e}")
+            return 0
+        if evicted:
+            print_verbose(f"Scan index: evicted {evicted} rows not seen for {EVICT_AFTER // 86400} days")
+        return evicted
+
+    def close(self):
+        self.flush()
+        self.evict()
+        for conn in self._connections:
+            conn.close()
+        self._connections = []
+        self._local = threading.local()
+
+def open_index(path: str, params: str) -> Optional[ScanIndex]:
+    try:
+        return ScanIndex(path, params)
+    except (OSError, sqlite3.Error) as e:
+        print_verbose(f"Scan index disabled, cannot open {path}: {e}")
+        return None
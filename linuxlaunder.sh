@@ -28,7 +28,7 @@ if [ ! -f "$PYTHON_SCRIPT" ]; then
 fi
 
 # Check if all required Python modules are present
-required_modules=("file_utils.py" "folder_utils.py" "package_utils.py" "output_utils.py" "scan_utils.py")
+required_modules=("file_utils.py" "folder_utils.py" "package_utils.py" "output_utils.py" "scan_utils.py" "index_utils.py" "result_utils.py" "ui_utils.py" "delete_utils.py" "duplicate_utils.py" "mount_utils.py" "filter_utils.py" "snapshot_utils.py" "profile_utils.py" "export_utils.py")
 for module in "${required_modules[@]}"; do
     if [ ! -f "$SCRIPT_DIR/$module" ]; then
         echo "Required Python module not found: $module"
@@ -41,13 +41,30 @@ print_usage() {
     echo "Usage: $0 [OPTIONS]"
     echo "Options:"
     echo "  -d, --directory DIR    Specify the directory to scan (default: /)"
-    echo "  -i, --ignore DIR       Specify directories to ignore during the scan (can be used multiple times)"
-    echo "  -s, --scan-type TYPE   Specify the type of scan (all, media, document, archive, temporary, package, malicious)"
+    echo "  -i, --ignore RULE      Ignore entries matching a name, glob, path or size/age/owner rule (can be used multiple times)"
+    echo "      --ignore-file PATH Read ignore rules from a file, one per line (can be used multiple times)"
+    echo "  -s, --scan-type TYPE   Specify the type of scan (all, media, document, archive, temporary, package, malicious, duplicate)"
+    echo "      --package-root DIR Root directory whose package database is read (default: /)"
     echo "  -t, --threshold SIZE   Set the size threshold in MB for reporting large files (default: 100)"
+    echo "      --top N            Only keep the N largest files and the N largest folders"
     echo "  -v, --verbose          Enable verbose output"
     echo "  -q, --quiet            Enable quiet mode (suppresses all output except results)"
-    echo "      --max-depth DEPTH  Maximum depth for subfolder size checking (default: 4)"
+    echo "      --max-depth DEPTH  Maximum depth of folders to report (default: 4)"
     echo "      --hide-deep-files  Hide files in directories beyond max depth"
+    echo "  -x, --one-file-system  Stay on the filesystem of the scanned directory"
+    echo "      --pseudo-filesystems  Also descend into pseudo and memory-backed filesystems (proc, sysfs, tmpfs, ...)"
+    echo "  -j, --jobs N           Number of parallel directory scanning workers"
+    echo "      --sniff            Also classify large files by their content (magic signatures)"
+    echo "      --disk-usage       Report allocated disk usage (like du) instead of apparent file sizes"
+    echo "      --dry-run          Report what removing the selected items would reclaim without removing anything"
+    echo "      --save-snapshot PATH  Save the size of every scanned directory to a snapshot file"
+    echo "      --diff SNAPSHOT    Report the directories that grew or shrank the most since a snapshot"
+    echo "      --profile PATH     Write a JSON report of timings, throughput, cache hit rates and errors"
+    echo "      --progress SECONDS Print a progress line every SECONDS while scanning"
+    echo "      --format FORMAT    Write records as ndjson or csv as they are found, without the report or the menu"
+    echo "  -o, --output PATH      File to write --format records to (default: stdout)"
+    echo "      --index [PATH]     Reuse unchanged directories from a scan index (default: ~/.cache/linuxlaunder/index.sqlite)"
+    echo "      --no-index         Use neither the scan index nor the package cache"
     echo "  -h, --help             Display this help message and exit"
 }
 
@@ -67,16 +84,31 @@ while [[ $# -gt 0 ]]; do
             shift
             shift
             ;;
+        --ignore-file)
+            ARGS+=("--ignore-file" "$2")
+            shift
+            shift
+            ;;
         -s|--scan-type)
             ARGS+=("--scan-type" "$2")
             shift
             shift
             ;;
+        --package-root)
+            ARGS+=("--package-root" "$2")
+            shift
+            shift
+            ;;
         -t|--threshold)
             ARGS+=("--threshold" "$2")
             shift
             shift
             ;;
+        --top)
+            ARGS+=("--top" "$2")
+            shift
+            shift
+            ;;
         -v|--verbose)
             ARGS+=("--verbose")
             shift
@@ -94,6 +126,75 @@ while [[ $# -gt 0 ]]; do
             ARGS+=("--hide-deep-files")
             shift
             ;;
+        -x|--one-file-system)
+            ARGS+=("--one-file-system")
+            shift
+            ;;
+        --pseudo-filesystems)
+            ARGS+=("--pseudo-filesystems")
+            shift
+            ;;
+        -j|--jobs)
+            ARGS+=("--jobs" "$2")
+            shift
+            shift
+            ;;
+        --sniff)
+            ARGS+=("--sniff")
+            shift
+            ;;
+        --disk-usage)
+            ARGS+=("--disk-usage")
+            shift
+            ;;
+        --dry-run)
+            ARGS+=("--dry-run")
+            shift
+            ;;
+        --save-snapshot)
+            ARGS+=("--save-snapshot" "$2")
+            shift
+            shift
+            ;;
+        --diff)
+            ARGS+=("--diff" "$2")
+            shift
+            shift
+            ;;
+        --profile)
+            ARGS+=("--profile" "$2")
+            shift
+            shift
+            ;;
+        --progress)
+            ARGS+=("--progress" "$2")
+            shift
+            shift
+            ;;
+        --format)
+            ARGS+=("--format" "$2")
+            shift
+            shift
+            ;;
+        -o|--output)
+            ARGS+=("--output" "$2")
+            shift
+            shift
+            ;;
+        --index)
+            # The path is optional
+            if [[ $# -gt 1 && "$2" != -* ]]; then
+                ARGS+=("--index" "$2")
+                shift
+            else
+                ARGS+=("--index")
+            fi
+            shift
+            ;;
+        --no-index)
+            ARGS+=("--no-index")
+            shift
+            ;;
         -h|--help)
             print_usage
             exit 0
@@ -3,160 +3,247 @@
 import argparse
 import sys
 import os
-import curses
-from scan_utils import run_scan
-from package_utils import get_installed_packages, uninstall_package
-from output_utils import print_list, print_folders, print_packages, print_quiet, set_output_mode, format_size
-from file_utils import remove_file
-from folder_utils import remove_folder
-
-class TreeNode:
-    def __init__(self, name, path, size, is_file=False):
-        self.name = name
-        self.path = path
-        self.size = size
-        self.is_file = is_file
-        self.children = []
-        self.expanded = False
-        self.selected = False
-
-def build_folder_tree(items):
+import concurrent.futures
+
+# Helper modules, curses and the package reader are imported where they are
+# first needed, so argument parsing and file-only scans never pay for them.
+
+FILE_ONLY_SCAN_TYPES = {'media', 'document', 'archive', 'temporary', 'package', 'malicious', 'duplicate'}
+
+def build_folder_tree(results):
+    import profile_utils
+    from result_utils import FOLDER
+    from ui_utils import TreeNode
+
     root = TreeNode("", "", 0)
-    nodes = {"": root}  # Use empty string as key for root
-
-    # Create a dictionary of sizes from items
-    size_dict = {path: size for path, size, _ in items}
-    # print(size_dict)
-
-
-    # Build the tree
-    for path, size, item_type in items:
-        parts = path.split(os.sep)
-        current_path = ""
-        for part in parts:
-            prev_path = current_path
-            current_path = os.path.join(current_path, part)
-            if current_path not in nodes:
-                parent = nodes[prev_path]
-                proper_path = '/' + current_path
-                if not size_dict.get(proper_path):
-                    proper_path = proper_path + '/'
-                new_node = TreeNode(part, current_path, size_dict.get(proper_path, 0), item_type != 'folder')
-                parent.children.append(new_node)
-                nodes[current_path] = new_node
-
-    # Sort children of each node by size
-    def sort_children(node):
-        node.children.sort(key=lambda x: x.size, reverse=True)
-        for child in node.children:
-            sort_children(child)
-
-    sort_children(root)
-    return root
+    nodes = []
 
-def flatten_folder_tree(node, prefix="", depth=0):
-    flat_list = []
-    if node.name:
-        if node.selected:
-            expander = "x"
-        elif node.children:
-            expander = "-" if node.expanded else "+"
-        else:
-            expander = " "
-        flat_list.append((f"{prefix}[{expander}] {node.name}", node, depth))
-    if node.expanded or not node.name:
-        for child in node.children:
-            flat_list.extend(flatten_folder_tree(child, prefix + "│   ", depth + 1))
-    return flat_list
-
-def interactive_selection(stdscr, root_node, title):
-    curses.curs_set(0)
-    stdscr.clear()
-    
-    current_idx = 0
-    start_idx = 0
-    
-    while True:
-        stdscr.clear()
-        height, width = stdscr.getmaxyx()
-        
-        stdscr.addstr(0, 0, title, curses.A_BOLD)
-        stdscr.addstr(1, 0, "Use arrow keys to navigate, Enter to expand/collapse, Space to select/deselect, 'q' to confirm")
-        
-        flat_list = flatten_folder_tree(root_node)
-        
-        for idx, (item_str, node, depth) in enumerate(flat_list[start_idx:start_idx+height-3]):
-            if start_idx + idx == current_idx:
-                stdscr.addstr(idx+2, 0, "> ", curses.A_BOLD)
+    with profile_utils.phase("build_folder_tree"):
+        # Parents always precede their children in the results
+        for index in range(len(results)):
+            parent_index = results.parents[index]
+            name = results.name(index)
+            if parent_index < 0:
+                parent, path = root, name
             else:
-                stdscr.addstr(idx+2, 0, "  ")
-            
-            display_str = f"{item_str} ({format_size(node.size)})"
-            if len(display_str) > width - 3:
-                display_str = display_str[:width-6] + "..."
-            stdscr.addstr(idx+2, 2, display_str)
-        
-        stdscr.refresh()
-        
-        key = stdscr.getch()
-        if key == ord('q'):
-            return [node.path for _, node, _ in flat_list if node.selected]
-        elif key == ord(' '):
-            current_node = flat_list[current_idx][1]
-            current_node.selected = not current_node.selected
-            # Propagate selection to children
-            def toggle_children(node, state):
-                for child in node.children:
-                    child.selected = state
-                    toggle_children(child, state)
-            toggle_children(current_node, current_node.selected)
-        elif key == 10:  # Enter key
-            if flat_list[current_idx][1].children:
-                flat_list[current_idx][1].expanded = not flat_list[current_idx][1].expanded
-        elif key == curses.KEY_UP and current_idx > 0:
-            current_idx -= 1
-            if current_idx < start_idx:
-                start_idx = current_idx
-        elif key == curses.KEY_DOWN and current_idx < len(flat_list) - 1:
-            current_idx += 1
-            if current_idx >= start_idx + height - 3:
-                start_idx = current_idx - (height - 4)
+                parent = nodes[parent_index]
+                path = os.path.join(parent.path, name)
+            new_node = TreeNode(name, path, results.sizes[index], results.types[index] != FOLDER)
+            new_node.count = results.counts[index]
+            parent.add_child(new_node)
+            nodes.append(new_node)
+
+        # Sort children of each node by size
+        def sort_children(node):
+            node.children.sort(key=lambda x: x.size, reverse=True)
+            for child in node.children:
+                sort_children(child)
+
+        sort_children(root)
+    profile_utils.count("tree_nodes", len(nodes))
+    return root
+
+def build_duplicate_tree(results):
+    from ui_utils import TreeNode
+
+    # One folder-like node per group, sized by the space its extra copies take
+    root = TreeNode("", "", 0)
+    for group in results.duplicate_groups():
+        path, size, _ = group[0]
+        group_node = TreeNode(f"{len(group)} copies of {os.path.basename(path)}", "", size * (len(group) - 1))
+        for path, size, _ in group:
+            group_node.add_child(TreeNode(path, path, size, True))
+        root.add_child(group_node)
+    return root
+
+def duplicate_removals(selected_nodes):
+    from output_utils import print_quiet
+
+    # Selecting a group removes all but its first copy, and at least one copy
+    # of every group is always kept.
+    chosen = {}
+    for node in selected_nodes:
+        group = node.parent if node.is_file else node
+        copies = [node] if node.is_file else node.children[1:]
+        chosen.setdefault(id(group), (group, []))[1].extend(copies)
+    items = []
+    for group, copies in chosen.values():
+        if len(copies) == len(group.children):
+            print_quiet(f"Keeping {group.children[0].path}: every copy of it was selected")
+            copies = group.children[1:]
+        items.extend((copy.path, copy.size, 1) for copy in copies)
+    return items
+
+def positive_int(value: str) -> int:
+    number = int(value)
+    if number < 1:
+        raise argparse.ArgumentTypeError(f"must be at least 1, got {value}")
+    return number
+
+def start_package_inventory(args) -> concurrent.futures.Future:
+    from package_utils import get_installed_packages, default_package_cache_path
+
+    package_cache = None if args.no_index else default_package_cache_path(args.distro)
+    pool = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+    future = pool.submit(get_installed_packages, args.distro, args.package_root, package_cache)
+    pool.shutdown(wait=False)
+    return future
+
+def package_inventory(future: concurrent.futures.Future):
+    import subprocess
+    from output_utils import print_quiet
+
+    # A missing or damaged package database shouldn't end the run after the
+    # scan it waited for
+    try:
+        return future.result()
+    except (OSError, ValueError, subprocess.SubprocessError) as e:
+        print_quiet(f"Error: Cannot read installed packages: {e}")
+        return None
 
 def main():
     parser = argparse.ArgumentParser(description="Enhanced Disk Space Analyzer")
     parser.add_argument("--directory", "-d", default="/", help="Directory to scan")
-    parser.add_argument("--ignore", "-i", nargs="+", default=[], help="Directories to ignore")
-    parser.add_argument("--scan-type", "-s", choices=['all', 'media', 'document', 'archive', 'temporary', 'package', 'malicious'], default='all', help="Type of files to scan")
+    parser.add_argument("--ignore", "-i", nargs="+", action="extend", default=[], help="Ignore rules: names, gitignore-style globs and paths, or size/age/owner predicates")
+    parser.add_argument("--ignore-file", action="append", default=[], help="File of ignore rules, one per line (can be used multiple times)")
+    parser.add_argument("--scan-type", "-s", choices=['all', 'media', 'document', 'archive', 'temporary', 'package', 'malicious', 'duplicate'], default='all', help="Type of files to scan")
     parser.add_argument("--distro", choices=['arch', 'ubuntu'], default='arch', help="Linux distribution")
+    parser.add_argument("--package-root", default="/", help="Root directory whose package database is read (for chroots and container images)")
     parser.add_argument("--threshold", "-t", type=int, default=100, help="Size threshold in MB")
+    parser.add_argument("--top", type=positive_int, default=None, help="Only keep the N largest files and the N largest folders")
     parser.add_argument("--verbose", "-v", action="store_true", help="Enable verbose output")
     parser.add_argument("--quiet", "-q", action="store_true", help="Enable quiet mode (suppresses all output except results)")
-    parser.add_argument("--max-depth", type=int, default=4, help="Maximum depth for subfolder size checking")
+    parser.add_argument("--max-depth", type=int, default=4, help="Maximum depth of folders to report (sizes always include deeper content)")
+    parser.add_argument("--one-file-system", "-x", action="store_true", help="Stay on the filesystem of the scanned directory")
+    parser.add_argument("--pseudo-filesystems", action="store_true", help="Also descend into pseudo and memory-backed filesystems (proc, sysfs, tmpfs, ...)")
     parser.add_argument("--hide-deep-files", action="store_true", help="Hide files in directories beyond max depth")
+    parser.add_argument("--jobs", "-j", type=positive_int, default=None, help="Number of parallel directory scanning workers (default: CPU count + 4, at most 32)")
+    parser.add_argument("--sniff", action="store_true", help="Also classify files above the threshold by reading their first few KB and matching magic signatures")
+    parser.add_argument("--disk-usage", action="store_true", help="Report allocated disk usage (like du) instead of apparent file sizes")
+    parser.add_argument("--dry-run", action="store_true", help="Report what removing the selected files, folders and packages would reclaim without removing anything")
+    parser.add_argument("--save-snapshot", default=None, help="Save the size of every scanned directory to this snapshot file")
+    parser.add_argument("--diff", default=None, help="Report the directories that grew or shrank the most since this snapshot")
+    parser.add_argument("--profile", default=None, help="Write a JSON report of phase timings, throughput, cache hit rates and errors to this file")
+    parser.add_argument("--progress", type=float, default=None, help="Print a progress line every this many seconds while scanning")
+    parser.add_argument("--format", choices=['ndjson', 'csv'], default=None, help="Write file, folder and package records in this format as they are found, without the report or the menu")
+    parser.add_argument("--output", "-o", default=None, help="File to write --format records to (default: stdout)")
+    parser.add_argument("--index", nargs="?", const="", default=None, help="Reuse directories unchanged since the last run from a persistent scan index, optionally at this path (default: ~/.cache/linuxlaunder/index.sqlite). Files that grew in place are missed")
+    parser.add_argument("--no-index", action="store_true", help="Use neither the scan index nor the package cache")
     args = parser.parse_args()
 
     if args.verbose and args.quiet:
         print("Error: Cannot use both verbose and quiet modes simultaneously.")
         sys.exit(1)
 
+    from output_utils import print_list, print_folders, print_packages, print_duplicates, print_changes, print_quiet, set_output_mode, set_message_stream
+    from scan_utils import run_scan, DEFAULT_JOBS
+    from index_utils import default_index_path
+    from filter_utils import build_filter
+
     set_output_mode(args.verbose, args.quiet, args.hide_deep_files)
+    export = None
+    if args.format:
+        from export_utils import RecordWriter
+        if not args.output:
+            set_message_stream(sys.stderr)
+        try:
+            export = RecordWriter(args.format, args.output)
+        except OSError as e:
+            print(f"Error: Cannot write {args.output}: {e}")
+            sys.exit(1)
+    if args.profile:
+        import atexit
+        import profile_utils
+        profile_utils.start_profile()
+        atexit.register(profile_utils.write_profile, args.profile)
+    if args.jobs is None:
+        args.jobs = DEFAULT_JOBS
+    # The index trusts directory mtimes, which don't change when a file grows
+    # in place, so it is only used when asked for.
+    if args.index == "":
+        args.index = default_index_path()
+    if args.no_index:
+        args.index = None
+    try:
+        file_filter = build_filter(args.ignore, args.ignore_file)
+    except (OSError, ValueError) as e:
+        print(f"Error: Invalid ignore rules: {e}")
+        sys.exit(1)
 
     print_quiet(f"Scanning directory: {args.directory}")
     print_quiet(f"Ignore list: {args.ignore}")
+    if args.ignore_file:
+        print_quiet(f"Ignore files: {args.ignore_file}")
     print_quiet(f"Scan type: {args.scan_type}")
     print_quiet(f"Distribution: {args.distro}")
     print_quiet(f"Threshold: {args.threshold} MB")
+    print_quiet(f"Top: {args.top if args.top else 'all'}")
     print_quiet(f"Max depth: {args.max_depth}")
     print_quiet(f"Hide deep files: {args.hide_deep_files}")
+    print_quiet(f"One file system: {args.one_file_system}")
+    print_quiet(f"Jobs: {args.jobs}")
+    print_quiet(f"Size mode: {'allocated' if args.disk_usage else 'apparent'}")
+    print_quiet(f"Content sniffing: {args.sniff}")
+    print_quiet(f"Scan index: {args.index or 'disabled'}")
+
+    # The package inventory is independent of the filesystem walk, so it runs
+    # alongside it and is only waited for once package data is needed.
+    packages = None if args.scan_type in FILE_ONLY_SCAN_TYPES else start_package_inventory(args)
 
-    large_files, large_folders = run_scan(args.directory, args.ignore, args.scan_type, args.max_depth)
+    # A diff needs the current scan as a snapshot too; without --save-snapshot
+    # it goes to a temporary file.
+    snapshot_path = args.save_snapshot
+    if args.diff:
+        from snapshot_utils import snapshot_info
+        previous = snapshot_info(args.diff)
+        if previous is None:
+            print(f"Error: Cannot read snapshot {args.diff}")
+            sys.exit(1)
+        if os.path.realpath(previous[0]) != os.path.realpath(args.directory):
+            print_quiet(f"Warning: {args.diff} is a snapshot of {previous[0]}, not {args.directory}")
+        if not snapshot_path:
+            import tempfile
+            fd, snapshot_path = tempfile.mkstemp(prefix="linuxlaunder-", suffix=".snapshot")
+            os.close(fd)
 
-    print_list(large_files, args.threshold, "file")
-    print_folders(large_folders, args.threshold)
-    large_packages = get_installed_packages(args.distro)
-    print_packages(large_packages, args.threshold)
+    # Only the top N can't be streamed: they are known once the scan is done
+    streamed = export is not None and args.top is None
+    installed = None
+    try:
+        results = run_scan(args.directory, file_filter, args.scan_type, args.max_depth, args.index, args.jobs, args.disk_usage,
+                           args.threshold * 1024 * 1024, args.top, args.sniff, args.one_file_system, args.pseudo_filesystems,
+                           snapshot_path, args.progress, export if streamed else None)
+        if packages:
+            installed = package_inventory(packages)
+        if export:
+            from export_utils import export_results
+            export_results(export, results, installed, args.threshold * 1024 * 1024, streamed)
+            export.close()
+    except BrokenPipeError:
+        # The reader went away (e.g. piped into head); keep the interpreter
+        # from failing again when it flushes stdout on exit.
+        os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+        sys.exit(1)
 
-    large_files = [x for x in large_files if x[1] == 0]
+    if export:
+        print_quiet(f"Exported {export.records} records")
+    else:
+        print_list(results.files(), args.threshold, "file")
+        print_folders(results.folders(), args.threshold)
+        if args.scan_type == 'duplicate':
+            print_duplicates(results.duplicate_groups())
+        if installed is not None:
+            print_packages(installed, args.threshold)
+    if args.diff:
+        import time
+        from snapshot_utils import diff_snapshots, DIFF_LIMIT
+        growers, shrinkers = diff_snapshots(args.diff, snapshot_path, args.top or DIFF_LIMIT)
+        if snapshot_path != args.save_snapshot:
+            os.unlink(snapshot_path)
+        print_changes(f"Largest growth since {time.ctime(previous[1])}", growers)
+        print_changes(f"Largest shrinkage since {time.ctime(previous[1])}", shrinkers)
+    if export:
+        return
 
     while True:
         print_quiet("\nOptions:")
@@ -167,24 +254,40 @@ def main():
         choice = input("Enter your choice (1-3): ").strip()
         
         if choice == '1':
-            items = [(f[0], f[1], f[2]) for f in large_files if f[1] > args.threshold * 1024 * 1024] + \
-                    [(f[0], f[1], 'folder') for f in large_folders if f[1] > args.threshold * 1024 * 1024]
-            root_node = build_folder_tree(items)
-            items_to_remove = curses.wrapper(interactive_selection, root_node.children[0].children[0], "Select files and folders to remove")
-            for item_path in items_to_remove:
-                if os.path.isfile(item_path):
-                    remove_file(item_path)
-                elif os.path.isdir(item_path):
-                    remove_folder(item_path)
+            import curses
+            from ui_utils import interactive_selection
+            from delete_utils import delete_items
+
+            if args.scan_type == 'duplicate':
+                root_node = build_duplicate_tree(results)
+                items_to_remove = curses.wrapper(interactive_selection, root_node,
+                                                 "Select duplicates to remove (a selected group keeps its first copy)")
+                delete_items(duplicate_removals(items_to_remove), args.jobs, args.dry_run)
+            else:
+                root_node = build_folder_tree(results)
+                items_to_remove = curses.wrapper(interactive_selection, root_node, "Select files and folders to remove")
+                delete_items([(node.path, node.size, node.count) for node in items_to_remove], args.jobs, args.dry_run)
         elif choice == '2':
+            import curses
+            from ui_utils import TreeNode, interactive_selection
+            from package_utils import removal_plan, print_removal_preview, uninstall_packages
+
+            if installed is None:
+                installed = package_inventory(start_package_inventory(args))
+                if installed is None:
+                    continue
             packages_root = TreeNode("", "", 0)
-            for package, size in sorted(large_packages, key=lambda x: x[1], reverse=True):
-                if size > args.threshold * 1024:  # size is in KB, threshold is in MB
-                    packages_root.children.append(TreeNode(package, package, size * 1024, True))
+            for package, size, *_ in sorted(installed, key=lambda x: x[1], reverse=True):
+                if size > args.threshold * 1024 * 1024:
+                    packages_root.add_child(TreeNode(package, package, size, True))
             packages_root.children.sort(key=lambda x: x.size, reverse=True)
             packages_to_remove = curses.wrapper(interactive_selection, packages_root, "Select packages to uninstall")
-            for package_name in packages_to_remove:
-                uninstall_package(package_name, args.distro)
+            selected_packages = [node.path for node in packages_to_remove]
+            if selected_packages:
+                removed, orphans = removal_plan(installed, selected_packages)
+                print_removal_preview(removed, orphans)
+                if not args.dry_run:
+                    uninstall_packages([package.name for package in removed + orphans], args.distro)
         elif choice == '3':
             print_quiet("Exiting the program.")
             break
@@ -0,0 +1,64 @@
+import os
+import re
+from typing import Dict, NamedTuple, Optional
+from output_utils import print_verbose
+
+MOUNTINFO = "/proc/self/mountinfo"
+# Kernel and memory-backed filesystems: they hold no data on disk, and some
+# of them (proc, sysfs) are huge or block on reads.
+PSEUDO_FILESYSTEMS = {
+    'proc', 'sysfs', 'devtmpfs', 'devpts', 'tmpfs', 'ramfs', 'cgroup', 'cgroup2', 'securityfs',
+    'debugfs', 'tracefs', 'pstore', 'bpf', 'configfs', 'fusectl', 'mqueue', 'hugetlbfs', 'autofs',
+    'binfmt_misc', 'efivarfs', 'rpc_pipefs', 'nsfs', 'selinuxfs',
+}
+
+class Mount(NamedTuple):
+    mount_id: int
+    # "major:minor" of the filesystem
+    device: str
+    path: str
+    fstype: str
+
+def unescape(field: str) -> str:
+    # Spaces, tabs, newlines and backslashes are written as octal escapes
+    return re.sub(r'\\([0-7]{3})', lambda m: chr(int(m.group(1), 8)), field)
+
+def read_mounts(mountinfo: str = MOUNTINFO) -> Dict[str, Mount]:
+    mounts: Dict[str, Mount] = {}
+    try:
+        with open(mountinfo) as f:
+            for line in f:
+                fields = line.split()
+                try:
+                    separator = fields.index('-', 6)
+                    mount = Mount(int(fields[0]), fields[2], unescape(fields[4]), fields[separator + 1])
+                except (ValueError, IndexError):
+                    continue
+                # Later mounts on the same path hide the earlier ones
+                mounts[mount.path] = mount
+    except OSError as e:
+        print_verbose(f"Cannot read {mountinfo}, mount points are not detected: {e}")
+    return mounts
+
+def mount_of(path: str, mounts: Dict[str, Mount]) -> Optional[Mount]:
+    path = os.path.realpath(path)
+    while True:
+        if path in mounts:
+            return mounts[path]
+        parent = os.path.dirname(path)
+        if parent == path:
+            return None
+        path = parent
+
+def mounts_below(directory: str, mounts: Dict[str, Mount]) -> Dict[str, Mount]:
+    # Mount points under directory, keyed by the path the walker will build
+    # for them (directory joined with the relative components).
+    root = os.path.realpath(directory)
+    below = {}
+    for path, mount in mounts.items():
+        if path != root and path.startswith(root.rstrip(os.sep) + os.sep):
+            below[os.path.join(directory, os.path.relpath(path, root))] = mount
+    return below
+
+def is_pseudo(mount: Mount) -> bool:
+    return mount.fstype in PSEUDO_FILESYSTEMS
@@ -1,8 +1,10 @@
-from typing import List, Tuple
+from typing import Iterable, List, Optional, TextIO, Tuple
 
 VERBOSE = False
 QUIET = False
 HIDE_DEEP_FILES = False
+# Where messages go; None is stdout. Exports to stdout move them to stderr.
+MESSAGES: Optional[TextIO] = None
 
 def set_output_mode(verbose: bool, quiet: bool, hide_deep_files: bool):
     global VERBOSE, QUIET, HIDE_DEEP_FILES
@@ -10,13 +12,17 @@ def set_output_mode(verbose: bool, quiet: bool, hide_deep_files: bool):
     QUIET = quiet
     HIDE_DEEP_FILES = hide_deep_files
 
+def set_message_stream(stream: Optional[TextIO]):
+    global MESSAGES
+    MESSAGES = stream
+
 def print_verbose(message):
     if VERBOSE and not QUIET:
-        print(message)
+        print(message, file=MESSAGES)
 
 def print_quiet(message):
     if not QUIET:
-        print(message)
+        print(message, file=MESSAGES)
 
 def format_size(size_in_bytes: int) -> str:
     for unit in ['B', 'KB', 'MB', 'GB', 'TB']:
@@ -25,20 +31,34 @@ def format_size(size_in_bytes: int) -> str:
         size_in_bytes /= 1024.0
     return f"{size_in_bytes:.2f} PB"
 
-def print_list(items: List[Tuple[str, int, str]], threshold: int, item_type: str):
+def print_list(items: Iterable[Tuple[str, int, str]], threshold: int, item_type: str):
     print_quiet(f"\nLarge {item_type}s:")
     for item, size, item_subtype in items:
         if size > threshold * 1024 * 1024:  # Convert MB to bytes
             print_quiet(f"{item} ({item_subtype}): {format_size(size)}")
 
-def print_folders(folders: List[Tuple[str, int]], threshold: int):
+def print_folders(folders: Iterable[Tuple[str, int]], threshold: int):
     print_quiet("\nLarge folders:")
     for folder, size in folders:
         if size > threshold * 1024 * 1024:  # Convert MB to bytes
             print_quiet(f"{folder}: {format_size(size)}")
 
-def print_packages(packages: List[Tuple[str, int]], threshold: int):
+def print_packages(packages: Iterable[Tuple], threshold: int):
     print_quiet("\nLarge packages:")
-    for package, size in packages:
-        if size > threshold * 1024:  # Package sizes are in KB
-            print_quiet(f"{package}: {format_size(size * 1024)}")  # Convert KB to bytes for consistent formatting
+    for package, size, *_ in packages:
+        if size > threshold * 1024 * 1024:  # Convert MB to bytes
+            print_quiet(f"{package}: {format_size(size)}")
+
+def print_duplicates(groups: Iterable[List[Tuple[str, int, str]]]):
+    print_quiet("\nDuplicate files:")
+    for group in groups:
+        size = group[0][1]
+        print_quiet(f"{len(group)} copies of {format_size(size)} ({format_size(size * (len(group) - 1))} reclaimable):")
+        for path, _, _ in group:
+            print_quiet(f"  {path}")
+
+def print_changes(title: str, changes: Iterable[Tuple[str, int, int]]):
+    print_quiet(f"\n{title}:")
+    for path, old_size, new_size in changes:
+        sign = '+' if new_size >= old_size else '-'
+        print_quiet(f"{path}: {sign}{format_size(abs(new_size - old_size))} ({format_size(old_size)} -> {format_size(new_size)})")
@@ -1,6 +1,13 @@
+import os
+import re
+import json
+import shutil
 import subprocess
-from typing import List, Tuple
-from output_utils import print_quiet
+import concurrent.futures
+from typing import Dict, Iterator, List, NamedTuple, Optional, Set, Tuple
+from index_utils import default_index_path
+from output_utils import print_quiet, print_verbose, format_size
+import profile_utils
 
 def parse_size(size_str: str) -> int:
     size_str = size_str.lower()
@@ -19,8 +26,132 @@ def parse_size(size_str: str) -> int:
     else:
         return int(float(size_str))  # Assume it's already in KB
 
-def get_installed_packages(distro: str) -> List[Tuple[str, int]]:
-    print_quiet("Retrieving installed packages...")
+PACMAN_DB = "var/lib/pacman/local"
+DPKG_STATUS = "var/lib/dpkg/status"
+APT_EXTENDED_STATES = "var/lib/apt/extended_states"
+
+class Package(NamedTuple):
+    name: str
+    size: int
+    depends: Tuple[str, ...] = ()
+    provides: Tuple[str, ...] = ()
+    explicit: bool = True
+
+def default_package_cache_path(distro: str) -> str:
+    return os.path.join(os.path.dirname(default_index_path()), f"packages-{distro}.json")
+
+def package_db_path(distro: str, root: str = "/") -> str:
+    if distro == 'arch':
+        return os.path.join(root, PACMAN_DB)
+    elif distro == 'ubuntu':
+        return os.path.join(root, DPKG_STATUS)
+    raise ValueError(f"Unsupported distribution: {distro}")
+
+def strip_version(dependency: str) -> str:
+    # "glibc>=2.38", "libc6 (>= 2.34)" and "python3:any" all name the package before the constraint
+    return re.split(r"[<>=:( ]", dependency.strip(), 1)[0]
+
+def parse_pacman_desc(desc_path: str) -> Optional[Package]:
+    try:
+        with open(desc_path, encoding="utf-8", errors="replace") as f:
+            sections = f.read().split("\n\n")
+    except OSError:
+        return None
+    fields = {}
+    for section in sections:
+        lines = section.strip("\n").split("\n")
+        if lines[0].startswith("%") and lines[0].endswith("%"):
+            fields[lines[0]] = lines[1:]
+    if not fields.get("%NAME%"):
+        return None
+    # One damaged desc file skips that package, not the whole inventory
+    try:
+        size = int((fields.get("%SIZE%") or ["0"])[0])
+    except ValueError:
+        print_verbose(f"Skipping {desc_path}: invalid %SIZE%")
+        return None
+    return Package(fields["%NAME%"][0],
+                   size,
+                   tuple(strip_version(dep) for dep in fields.get("%DEPENDS%", [])),
+                   tuple(strip_version(name) for name in fields.get("%PROVIDES%", [])),
+                   fields.get("%REASON%", ["0"])[0] != "1")
+
+def read_pacman_db(db_path: str) -> List[Package]:
+    with os.scandir(db_path) as entries:
+        desc_paths = [os.path.join(entry.path, "desc") for entry in entries if entry.is_dir()]
+    with concurrent.futures.ThreadPoolExecutor() as pool:
+        return [package for package in pool.map(parse_pacman_desc, desc_paths, chunksize=64) if package]
+
+def read_control_stanzas(path: str) -> Iterator[Dict[str, str]]:
+    with open(path, encoding="utf-8", errors="replace") as f:
+        for stanza in f.read().split("\n\n"):
+            fields = {}
+            for line in stanza.splitlines():
+                key, sep, value = line.partition(":")
+                if sep and not line[:1].isspace():
+                    fields[key] = value.strip()
+            if fields:
+                yield fields
+
+def read_dpkg_status(status_path: str, extended_states_path: Optional[str] = None) -> List[Package]:
+    auto_installed = set()
+    if extended_states_path and os.path.exists(extended_states_path):
+        for fields in read_control_stanzas(extended_states_path):
+            if fields.get("Auto-Installed") == "1":
+                auto_installed.add(fields.get("Package"))
+
+    packages = []
+    for fields in read_control_stanzas(status_path):
+        if "Package" in fields and fields.get("Status", "").endswith(" installed"):
+            try:
+                # Installed-Size is in KiB
+                size = int(fields.get("Installed-Size", "0")) * 1024
+            except ValueError:
+                print_verbose(f"Skipping {fields['Package']}: invalid Installed-Size")
+                continue
+            # Every alternative of "a | b" is kept, so nothing that might satisfy
+            # a dependency is ever predicted to become an orphan.
+            relations = ",".join(fields.get(key, "") for key in ("Pre-Depends", "Depends"))
+            depends = tuple(strip_version(alternative) for relation in relations.split(",")
+                            for alternative in relation.split("|") if alternative.strip())
+            provides = tuple(strip_version(name) for name in fields.get("Provides", "").split(",") if name.strip())
+            packages.append(Package(fields["Package"], size, depends, provides, fields["Package"] not in auto_installed))
+    return packages
+
+def read_package_db(distro: str, root: str = "/", cache_path: Optional[str] = None) -> List[Package]:
+    db_path = package_db_path(distro, root)
+    extended_states_path = os.path.join(root, APT_EXTENDED_STATES)
+    cache_key = [distro, os.path.abspath(db_path), os.stat(db_path).st_mtime_ns]
+    if distro == 'ubuntu' and os.path.exists(extended_states_path):
+        cache_key.append(os.stat(extended_states_path).st_mtime_ns)
+    if cache_path:
+        try:
+            with open(cache_path) as f:
+                cached = json.load(f)
+            if cached["key"] == cache_key:
+                profile_utils.count("package_cache_hits")
+                return [Package(name, size, tuple(depends), tuple(provides), explicit)
+                        for name, size, depends, provides, explicit in cached["packages"]]
+        except (OSError, ValueError, KeyError, TypeError):
+            pass
+
+    if cache_path:
+        profile_utils.count("package_cache_misses")
+    if distro == 'arch':
+        packages = read_pacman_db(db_path)
+    else:
+        packages = read_dpkg_status(db_path, extended_states_path)
+
+    if cache_path:
+        try:
+            os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+            with open(cache_path, "w") as f:
+                json.dump({"key": cache_key, "packages": packages}, f)
+        except OSError as e:
+            print_verbose(f"Error writing package cache {cache_path}: {e}")
+    return packages
+
+def query_package_manager(distro: str) -> List[Package]:
     if distro == 'arch':
         cmd = "pacman -Qi | awk '/^Name/{name=$3} /^Installed Size/{size=$4$5; print name, size}'"
     elif distro == 'ubuntu':
@@ -37,22 +168,98 @@ def get_installed_packages(distro: str) -> List[Tuple[str, int]]:
             size_str = ' '.join(parts[1:])
             try:
                 size = parse_size(size_str)
-                packages.append((name, size))
+                packages.append(Package(name, size * 1024))
             except ValueError:
                 print(f"Warning: Could not parse size for package {name}: {size_str}")
-    return sorted(packages, key=lambda x: x[1], reverse=True)
+    return packages
 
-def uninstall_package(package: str, distro: str):
+def get_installed_packages(distro: str, root: str = "/", cache_path: Optional[str] = None) -> List[Package]:
+    print_quiet("Retrieving installed packages...")
+    with profile_utils.phase("package_inventory"):
+        try:
+            packages = read_package_db(distro, root, cache_path)
+        except (OSError, ValueError) as e:
+            if root != "/":
+                raise
+            print_verbose(f"Cannot read the package database directly ({e}), querying the package manager")
+            profile_utils.count("package_manager_queries")
+            packages = query_package_manager(distro)
+    profile_utils.count("packages", len(packages))
+    return sorted(packages, key=lambda x: x.size, reverse=True)
+
+def removal_plan(packages: List[Package], targets: List[str]) -> Tuple[List[Package], List[Package]]:
+    by_name = {package.name: package for package in packages}
+    providers: Dict[str, List[str]] = {}
+    for package in packages:
+        for name in (package.name,) + package.provides:
+            providers.setdefault(name, []).append(package.name)
+
+    def unneeded(installed: Set[str]) -> Set[str]:
+        # Packages not reachable from an explicitly installed one
+        needed = set()
+        pending = [name for name in installed if by_name[name].explicit]
+        while pending:
+            name = pending.pop()
+            if name in needed:
+                continue
+            needed.add(name)
+            for dependency in by_name[name].depends:
+                pending.extend(provider for provider in providers.get(dependency, []) if provider in installed)
+        return installed - needed
+
+    removed = [by_name[name] for name in targets if name in by_name]
+    installed = set(by_name)
+    remaining = installed - {package.name for package in removed}
+    orphans = unneeded(remaining) - unneeded(installed)
+    # Orphans are removed by name, so any that a package staying installed
+    # still depends on (such as an orphan from before) are kept, along with
+    # whatever they depend on in turn
+    changed = True
+    while changed:
+        staying = remaining - orphans
+        required = {provider for name in staying for dependency in by_name[name].depends
+                    for provider in providers.get(dependency, [])}
+        changed = bool(orphans & required)
+        orphans -= required
+    return removed, sorted((by_name[name] for name in orphans), key=lambda x: x.size, reverse=True)
+
+def print_removal_preview(removed: List[Package], orphans: List[Package]):
+    print_quiet("\nPackages to remove:")
+    for package in removed:
+        print_quiet(f"{package.name}: {format_size(package.size)}")
+    if orphans:
+        print_quiet("\nDependencies no longer needed:")
+        for package in orphans:
+            print_quiet(f"{package.name}: {format_size(package.size)}")
+    total = sum(package.size for package in removed + orphans)
+    print_quiet(f"\nTotal reclaimed: {format_size(total)} in {len(removed) + len(orphans)} packages")
+
+def uninstall_packages(packages: List[str], distro: str):
+    # One transaction: a single privilege prompt, dependency resolution and
+    # database lock. Packages are named explicitly (orphans from removal_plan
+    # included) rather than left to -s or --auto-remove, which also take
+    # packages that were unneeded before and so aren't in the preview.
+    if not packages:
+        return
     if distro == 'arch':
-        cmd = ['sudo', 'pacman', '-R', package]
+        cmd = ['pacman', '-R'] + packages
     elif distro == 'ubuntu':
-        cmd = ['sudo', 'apt', 'remove', package]
+        cmd = ['apt-get', 'remove'] + packages
     else:
         print_quiet(f"Unsupported distribution: {distro}")
         return
+    # Resolved on the caller's PATH, which sudo's secure_path would replace
+    cmd[0] = shutil.which(cmd[0]) or cmd[0]
+    if os.geteuid() != 0:
+        cmd = ['sudo'] + cmd
 
-    try:
-        subprocess.run(cmd, check=True)
-        print_quiet(f"Uninstalled package: {package}")
-    except subprocess.CalledProcessError as e:
-        print_quiet(f"Error uninstalling package {package}: {e}")
+    with profile_utils.phase("uninstall"):
+        try:
+            subprocess.run(cmd, check=True)
+            profile_utils.count("packages_uninstalled", len(packages))
+            print_quiet(f"Uninstalled packages: {' '.join(packages)}")
+        except (OSError, subprocess.CalledProcessError) as e:
+            print_quiet(f"Error uninstalling packages {' '.join(packages)}: {e}")
+
+def uninstall_package(package: str, distro: str):
+    uninstall_packages([package], distro)
@@ -0,0 +1,106 @@
+import os
+import sys
+import json
+import time
+import heapq
+import resource
+import threading
+import contextlib
+from collections import defaultdict
+from typing import Dict, Iterator, List, Optional, Tuple
+from output_utils import print_quiet
+
+SLOWEST_DIRS = 20
+
+# Counters, phase timings and the slowest directories of one run. Phases may
+# run concurrently (the package inventory overlaps the walk), so each phase
+# records its own wall time rather than a share of the total.
+class Profile:
+    def __init__(self):
+        self.started = time.time()
+        self.phases: Dict[str, float] = defaultdict(float)
+        self.counters: Dict[str, int] = defaultdict(int)
+        self.errors: Dict[str, int] = defaultdict(int)
+        self.slowest: List[Tuple[float, str]] = []
+        self._lock = threading.Lock()
+
+    def count(self, name: str, amount: int = 1):
+        with self._lock:
+            self.counters[name] += amount
+
+    def error(self, error: OSError):
+        with self._lock:
+            self.errors[type(error).__name__] += 1
+
+    @contextlib.contextmanager
+    def phase(self, name: str) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            with self._lock:
+                self.phases[name] += time.perf_counter() - start
+
+    def directory_time(self, path: str, seconds: float):
+        if len(self.slowest) < SLOWEST_DIRS:
+            heapq.heappush(self.slowest, (seconds, path))
+        elif seconds > self.slowest[0][0]:
+            heapq.heapreplace(self.slowest, (seconds, path))
+
+    def report(self) -> dict:
+        usage = resource.getrusage(resource.RUSAGE_SELF)
+        counters = dict(self.counters)
+        walk = self.phases.get("walk", 0.0)
+
+        def rate(name: str) -> Optional[float]:
+            return round(counters.get(name, 0) / walk, 1) if walk else None
+
+        def hit_rate(prefix: str) -> dict:
+            hits, misses = counters.get(f"{prefix}_hits", 0), counters.get(f"{prefix}_misses", 0)
+            return {"hits": hits, "misses": misses,
+                    "hit_rate": round(hits / (hits + misses), 4) if hits + misses else None}
+
+        return {
+            "command": sys.argv,
+            "started": time.strftime("%Y-%m-%dT%H:%M:%S%z", time.localtime(self.started)),
+            "wall_seconds": round(time.time() - self.started, 3),
+            # CPU time well below wall time means the run waited on I/O
+            "cpu_seconds": {"user": round(usage.ru_utime, 3), "system": round(usage.ru_stime, 3)},
+            "max_rss_kb": usage.ru_maxrss,
+            "phases": {name: round(seconds, 3) for name, seconds in self.phases.items()},
+            "rates": {"directories_per_second": rate("directories"), "files_per_second": rate("files"),
+                      "bytes_per_second": rate("bytes")},
+            "caches": {"scan_index": hit_rate("scan_index"), "signatures": hit_rate("signatures"),
+                       "package_cache": hit_rate("package_cache")},
+            "errors": dict(self.errors),
+            "counters": counters,
+            "slowest_directories": [{"path": path, "seconds": round(seconds, 4)}
+                                    for seconds, path in sorted(self.slowest, reverse=True)],
+        }
+
+PROFILE: Optional[Profile] = None
+
+def start_profile():
+    global PROFILE
+    PROFILE = Profile()
+
+def phase(name: str):
+    return PROFILE.phase(name) if PROFILE else contextlib.nullcontext()
+
+def count(name: str, amount: int = 1):
+    if PROFILE:
+        PROFILE.count(name, amount)
+
+def write_profile(path: str):
+    if not PROFILE:
+        return
+    try:
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(path, "w") as f:
+            json.dump(PROFILE.report(), f, indent=2)
+            f.write("\n")
+        print_quiet(f"Profile written to {path}")
+    except OSError as e:
+        print_quiet(f"Error writing profile {path}: {e}")
@@ -0,0 +1,70 @@
+import os
+from array import array
+from typing import Dict, Iterator, List, Tuple
+from file_utils import FILE_CATEGORIES
+
+TYPE_NAMES = ['folder'] + FILE_CATEGORIES + ['other']
+TYPE_CODES = {name: code for code, name in enumerate(TYPE_NAMES)}
+FOLDER = TYPE_CODES['folder']
+
+# Scan results stored column-wise: entry i is the name segment names[name_ids[i]]
+# below entry parents[i] (-1 for the scan root). Parents are always added before
+# their children, so one pass in index order visits every parent first.
+class ScanResults:
+    def __init__(self):
+        self.names: List[str] = []
+        self._name_ids: Dict[str, int] = {}
+        self.name_ids = array('l')
+        self.parents = array('l')
+        self.sizes = array('q')
+        self.types = array('b')
+        # Number of inodes (files, links, directories) in each entry's subtree
+        self.counts = array('q')
+        # Indexes of the reported files and folders, largest first.
+        self.file_order = array('l')
+        self.folder_order = array('l')
+        # Duplicate groups: group g is group_members[group_starts[g]:group_starts[g + 1]]
+        self.group_starts = array('l')
+        self.group_members = array('l')
+
+    def __len__(self) -> int:
+        return len(self.parents)
+
+    def intern(self, name: str) -> int:
+        name_id = self._name_ids.get(name)
+        if name_id is None:
+            name_id = self._name_ids[name] = len(self.names)
+            self.names.append(name)
+        return name_id
+
+    def add(self, parent: int, name: str, size: int, item_type: str, count: int = 1) -> int:
+        self.name_ids.append(self.intern(name))
+        self.parents.append(parent)
+        self.sizes.append(size)
+        self.types.append(TYPE_CODES[item_type])
+        self.counts.append(count)
+        return len(self.parents) - 1
+
+    def name(self, index: int) -> str:
+        return self.names[self.name_ids[index]]
+
+    def path(self, index: int) -> str:
+        parts = []
+        while index >= 0:
+            parts.append(self.name(index))
+            index = self.parents[index]
+        return os.path.join(*reversed(parts))
+
+    def files(self) -> Iterator[Tuple[str, int, str]]:
+        for index in self.file_order:
+            yield self.path(index), self.sizes[index], TYPE_NAMES[self.types[index]]
+
+    def folders(self) -> Iterator[Tuple[str, int]]:
+        for index in self.folder_order:
+            yield self.path(index), self.sizes[index]
+
+    def duplicate_groups(self) -> Iterator[List[Tuple[str, int, str]]]:
+        ends = list(self.group_starts[1:]) + [len(self.group_members)]
+        for start, end in zip(self.group_starts, ends):
+            yield [(self.path(index), self.sizes[index], TYPE_NAMES[self.types[index]])
+                   for index in self.group_members[start:end]]
@@ -1,108 +1,438 @@
 import os
 import time
-import asyncio
+import heapq
+import queue
+import itertools
+import collections
 import concurrent.futures
-from typing import List, Tuple, Dict
-from file_utils import is_media_file, is_document_file, is_archive_file, is_temporary_file, is_package_file, is_potentially_malicious
-from output_utils import print_verbose, print_quiet
+from typing import Any, Iterator, List, Tuple, Dict, Optional
+from file_utils import classify_entries, classify_name, category_from_mask, sniff_file, sniffed_mask
+from index_utils import ScanIndex, open_index
+import output_utils
+from output_utils import print_verbose, print_quiet, format_size
+from result_utils import ScanResults
+from duplicate_utils import find_duplicates
+from mount_utils import read_mounts, mount_of, mounts_below, is_pseudo
+from filter_utils import FileFilter
+from snapshot_utils import SnapshotWriter
+from export_utils import RecordWriter
+import profile_utils
 
-file_info_cache: Dict[str, Tuple[float, int]] = {}
-folder_size_cache: Dict[str, Tuple[float, int]] = {}
+# Directory listing and stat calls release the GIL, so the walker scales with
+# threads well past the CPU count on fast or remote storage.
+DEFAULT_JOBS = min(32, (os.cpu_count() or 1) + 4)
 
-async def get_file_info(file_path: str, scan_type: str) -> Tuple[str, int, str]:
+# Per-directory scan records persisted across runs, keyed by (st_dev, st_ino)
+# and validated against the directory mtime.
+folder_size_cache: Optional[ScanIndex] = None
+
+# (size of singly-linked entries, [(name, size, type, link, apparent size)] of
+#  classified files, [subdirectory names], [(st_dev, st_ino, size)] of
+#  hard-linked entries, number of singly-linked entries).
+# link indexes into the hard-link list, or is -1 for a singly-linked file.
+# size is the allocated size with --disk-usage; duplicates are matched on the
+# apparent size, since sparse files of different lengths can share the other.
+DirRecord = Tuple[int, List[Tuple[str, int, str, int, int]], List[str], List[Tuple[int, int, int]], int]
+
+# Keeps the largest results above a size threshold in a min-heap, so memory is
+# bounded by the limit rather than by the number of entries scanned.
+class TopResults:
+    def __init__(self, threshold: int = 0, limit: Optional[int] = None):
+        self.threshold = threshold
+        self.limit = limit
+        self._heap: List[Tuple[int, int, Any]] = []
+        self._counter = itertools.count()
+
+    def push(self, size: int, item: Any):
+        if size <= self.threshold or (self.limit is not None and self.limit <= 0):
+            return
+        entry = (size, next(self._counter), item)
+        if self.limit is None or len(self._heap) < self.limit:
+            heapq.heappush(self._heap, entry)
+        elif size > self._heap[0][0]:
+            heapq.heapreplace(self._heap, entry)
+
+    def __len__(self) -> int:
+        return len(self._heap)
+
+    def __iter__(self) -> Iterator[Any]:
+        for _, _, item in sorted(self._heap, reverse=True):
+            yield item
+
+def index_params(scan_type: str, file_filter: FileFilter, allocated: bool, sniff: bool = False, directory: str = "") -> str:
+    # Records filtered by anchored rules are only valid for the same scan root
+    root = os.path.realpath(directory) if file_filter.anchored else ""
+    return "\0".join([scan_type, "allocated" if allocated else "apparent", "sniff" if sniff else "names", file_filter.key, root])
+
+def disk_size(st: os.stat_result, allocated: bool) -> int:
+    return st.st_blocks * 512 if allocated else st.st_size
+
+# rel_dir is dir_path relative to the scanned directory, with a trailing '/'
+# unless empty, which is what the filter's path rules are matched against.
+# Also returns (stat calls, entries that couldn't be stat'ed, seconds spent).
+def read_directory(dir_path: str, rel_dir: str, file_filter: FileFilter, scan_type: str, allocated: bool, sniff: bool = False) -> Tuple[os.stat_result, DirRecord, bool, Tuple[int, int, float]]:
+    start = time.perf_counter()
+    dir_stat = os.stat(dir_path)
+    record = folder_size_cache.lookup(dir_stat) if folder_size_cache else None
+    if record is not None:
+        return dir_stat, record, False, (1, 0, time.perf_counter() - start)
+
+    own_size = 0
+    own_count = 0
+    stat_calls = 1
+    stat_errors = 0
+    files = []
+    subdirs = []
+    links = []
+    file_entries = []
+    file_sizes = []
+    with os.scandir(dir_path) as entries:
+        for entry in entries:
+            # Excluded directories are never listed, excluded files never classified
+            if entry.is_dir(follow_symlinks=False):
+                if not file_filter or not file_filter.excludes_dir(rel_dir + entry.name, entry.name):
+                    subdirs.append(entry.name)
+                continue
+            if file_filter and file_filter.excludes_path(rel_dir + entry.name, entry.name):
+                continue
+            stat_calls += 1
+            try:
+                st = entry.stat(follow_symlinks=False)
+            except (FileNotFoundError, PermissionError):
+                stat_errors += 1
+                continue
+            if file_filter.predicates and file_filter.excludes_stat(st):
+                continue
+            size = disk_size(st, allocated)
+            link = -1
+            if st.st_nlink > 1:
+                # Counted once per inode by the scanner, not per name.
+                link = len(links)
+                links.append((st.st_dev, st.st_ino, size))
+            else:
+                own_size += size
+                own_count += 1
+            if entry.is_file(follow_symlinks=False):
+                file_entries.append(entry)
+                file_sizes.append((size, link, st.st_size))
+
+    # Duplicate scans compare every file, whatever its category, and sniffing
+    # may find a category the name doesn't show.
+    keep_other = scan_type == 'duplicate' or sniff
+    for (entry, file_type), (size, link, apparent) in zip(classify_entries(file_entries, scan_type), file_sizes):
+        if file_type != 'other' or keep_other:
+            files.append((entry.name, size, file_type, link, apparent))
+    return dir_stat, (own_size, files, subdirs, links, own_count), True, (stat_calls, stat_errors, time.perf_counter() - start)
+
+def collect_results(large_files: TopResults, large_folders: TopResults, duplicate_groups: List[List[Tuple]]) -> ScanResults:
+    results = ScanResults()
+    indexes: Dict[int, int] = {}
+    file_indexes: Dict[Tuple[int, str], int] = {}
+
+    # Materializes a pending directory and any ancestors not yet in the results.
+    def entry_for(node) -> int:
+        chain = []
+        while node is not None and id(node) not in indexes:
+            chain.append(node)
+            node = node[2]
+        index = indexes[id(node)] if node is not None else -1
+        for node in reversed(chain):
+            name = node[0] if node[2] is None else os.path.basename(node[0])
+            index = indexes[id(node)] = results.add(index, name, node[3], 'folder', node[6])
+        return index
+
+    for node in large_folders:
+        results.folder_order.append(entry_for(node))
+
+    # A file can be both large and duplicated, but is only added once
+    def file_entry(node, name, file_size, file_type) -> int:
+        key = (id(node), name)
+        if key not in file_indexes:
+            file_indexes[key] = results.add(entry_for(node), name, file_size, file_type, 1)
+        return file_indexes[key]
+
+    for file in large_files:
+        results.file_order.append(file_entry(*file))
+    for group in duplicate_groups:
+        results.group_starts.append(len(results.group_members))
+        for file in group:
+            results.group_members.append(file_entry(*file))
+    return results
+
+def sniff_entry(file_path: str) -> Tuple[Optional[os.stat_result], Optional[str], bool]:
     try:
-        stat = os.stat(file_path)
-        file_size = stat.st_size
-        mtime = stat.st_mtime
-
-        if file_path in file_info_cache:
-            cached_mtime, cached_size = file_info_cache[file_path]
-            if mtime == cached_mtime:
-                return file_path, cached_size, 'cached'
-
-        file_type = 'other'
-        if scan_type == 'all':
-            if await asyncio.to_thread(is_media_file, file_path):
-                file_type = 'media'
-            elif await asyncio.to_thread(is_document_file, file_path):
-                file_type = 'document'
-            elif await asyncio.to_thread(is_archive_file, file_path):
-                file_type = 'archive'
-            elif await asyncio.to_thread(is_temporary_file, file_path):
-                file_type = 'temporary'
-            elif await asyncio.to_thread(is_package_file, file_path):
-                file_type = 'package'
-            elif await asyncio.to_thread(is_potentially_malicious, file_path):
-                file_type = 'malicious'
-        elif scan_type == 'media' and await asyncio.to_thread(is_media_file, file_path):
-            file_type = 'media'
-        elif scan_type == 'document' and await asyncio.to_thread(is_document_file, file_path):
-            file_type = 'document'
-        elif scan_type == 'archive' and await asyncio.to_thread(is_archive_file, file_path):
-            file_type = 'archive'
-        elif scan_type == 'temporary' and await asyncio.to_thread(is_temporary_file, file_path):
-            file_type = 'temporary'
-        elif scan_type == 'package' and await asyncio.to_thread(is_package_file, file_path):
-            file_type = 'package'
-        elif scan_type == 'malicious' and await asyncio.to_thread(is_potentially_malicious, file_path):
-            file_type = 'malicious'
-
-        file_info_cache[file_path] = (mtime, file_size)
-        return file_path, file_size, file_type
-    except (FileNotFoundError, PermissionError):
-        return file_path, 0, 'error'
-
-async def scan_directory(directory: str, ignore_list: List[str], scan_type: str, max_depth: int) -> Tuple[List[Tuple[str, int, str]], List[Tuple[str, int]]]:
+        st = os.stat(file_path, follow_symlinks=False)
+    except OSError:
+        return None, None, False
+    kind = folder_size_cache.lookup_signature(st) if folder_size_cache else None
+    if kind is not None:
+        return st, kind, False
+    return st, sniff_file(file_path), True
+
+# Reclassifies files by their content. Only files above the threshold get
+# here, so the number of headers read follows the number of large files.
+def sniff_candidates(candidates: List[Tuple], scan_type: str, jobs: int) -> Iterator[Tuple]:
+    start_time = time.time()
+    sniffed = cached = 0
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, jobs)) as pool:
+        paths = [os.path.join(node[0], name) for node, name, _, _ in candidates]
+        for (node, name, file_size, _), (st, kind, fresh) in zip(candidates, pool.map(sniff_entry, paths, chunksize=64)):
+            if fresh and kind is not None:
+                sniffed += 1
+                profile_utils.count("signatures_misses")
+                if folder_size_cache:
+                    folder_size_cache.store_signature(st, kind)
+            elif kind is not None:
+                cached += 1
+                profile_utils.count("signatures_hits")
+            file_type = category_from_mask(sniffed_mask(classify_name(name), kind), scan_type)
+            if file_type != 'other' or scan_type == 'duplicate':
+                yield node, name, file_size, file_type
+    print_verbose(f"Content sniffing: {sniffed} files read, {cached} cached, in {time.time() - start_time:.2f} seconds")
+
+def device_jobs(jobs: int) -> int:
+    # A quarter of the workers, and at least one, is kept for other devices
+    # while they have work; a single worker can't be shared
+    return max(1, jobs - max(1, jobs // 4))
+
+def scan_directory(directory: str, file_filter: FileFilter, scan_type: str, max_depth: int, jobs: int = DEFAULT_JOBS, allocated: bool = False, threshold: int = 0, top: Optional[int] = None, sniff: bool = False, one_file_system: bool = False, pseudo_filesystems: bool = False, snapshot: Optional[SnapshotWriter] = None, progress: Optional[float] = None, export: Optional[RecordWriter] = None) -> ScanResults:
     print_quiet(f"Starting scan of directory: {directory}")
+    # Nothing would ever be dispatched with no workers
+    jobs = max(1, jobs)
     start_time = time.time()
-    
-    large_files = []
-    large_folders = []
-    
-    async def process_directory(dir_path: str, depth: int):
-        nonlocal large_files, large_folders
-        if depth > max_depth:
-            return 0
-        
-        try:
-            dir_stat = os.stat(dir_path)
-            dir_mtime = dir_stat.st_mtime
-            if dir_path in folder_size_cache:
-                cached_mtime, cached_size = folder_size_cache[dir_path]
-                if dir_mtime == cached_mtime:
-                    large_folders.append((dir_path, cached_size))
-                    return cached_size
-
-            total_size = 0
-            file_tasks = []
-            for entry in os.scandir(dir_path):
-                if entry.name in ignore_list:
-                    continue
-                if entry.is_file(follow_symlinks=False):
-                    file_tasks.append(get_file_info(entry.path, scan_type))
-                elif entry.is_dir(follow_symlinks=False):
-                    total_size += await process_directory(entry.path, depth + 1)
-
-            file_results = await asyncio.gather(*file_tasks)
-            for file_path, file_size, file_type in file_results:
-                total_size += file_size
-                if file_type not in ['other', 'error', 'cached']:
-                    large_files.append((file_path, file_size, file_type))
-
-            large_folders.append((dir_path, total_size))
-            folder_size_cache[dir_path] = (dir_mtime, total_size)
-            return total_size
-        except (PermissionError, FileNotFoundError):
-            print_verbose(f"Error accessing {dir_path}")
-            return 0
-
-    await process_directory(directory, 0)
+    profile = profile_utils.PROFILE
+    directories = files_seen = bytes_seen = stat_calls = stat_errors = 0
+
+    large_files = TopResults(threshold, top)
+    large_folders = TopResults(threshold, top)
+    reused = reread = 0
+    seen_inodes = set()
+    # Candidate duplicates by apparent size, as (path, file); hard links are already
+    # counted once per inode so they never show up as copies of themselves.
+    duplicates: Optional[Dict[int, List[Tuple[str, Tuple]]]] = {} if scan_type == 'duplicate' else None
+    # Large files whose category waits for content sniffing
+    unsniffed: List[Tuple] = []
+
+    # With an export, files and folders are written as soon as they are known
+    # instead of being kept for the results.
+    def keep_file(file):
+        if not export:
+            large_files.push(file[2], file)
+        elif file[2] > threshold:
+            export.record('file', os.path.join(file[0][0], file[1]), file[2], file[3])
+
+    def keep_folder(node):
+        if not export:
+            large_folders.push(node[3], node)
+        elif node[3] > threshold:
+            export.record('folder', node[0], node[3], 'folder', node[6])
+
+    mounts = read_mounts()
+    root_mount = mount_of(directory, mounts)
+    # Mount points are looked up by path when their parent is listed; the scan
+    # root itself is always walked, whatever its filesystem.
+    child_mounts = mounts_below(directory, mounts)
+    root_dev = None
+
+    # Pending directories are [path, depth, parent, total_size, unfinished_children, readable, total_count, device].
+    # Workers only list directories; sizes are aggregated here, bottom-up, as soon
+    # as the last child of a directory has finished. The whole tree is always
+    # walked so sizes are exact; max_depth only limits which folders are reported,
+    # deeper ones are folded into their ancestors' totals.
+    finished = queue.SimpleQueue()
+
+    def complete(node):
+        while node is not None:
+            path, depth, parent, total_size, _, readable, total_count, _ = node
+            if readable and depth <= max_depth:
+                keep_folder(node)
+            if readable and snapshot:
+                snapshot.add(path[len(directory):].lstrip(os.sep), total_size)
+            if parent is None:
+                return
+            parent[3] += total_size
+            parent[6] += total_count
+            parent[4] -= 1
+            if parent[4]:
+                return
+            node = parent
+
+    # Directories wait in one queue per device (mount), and while another device
+    # has work a device never has more than device_jobs of them being listed at
+    # once, so a slow or hung mount can't take every worker. Only as many
+    # directories as there are workers are handed to the pool, so nothing
+    # queues up behind a stuck one.
+    waiting: Dict[Any, collections.deque] = {}
+    running: Dict[Any, int] = collections.defaultdict(int)
+    per_device = device_jobs(jobs)
+
+    def report_progress():
+        elapsed = max(time.time() - start_time, 1e-9)
+        busy = ", ".join(f"{device.path if device else directory} ({count})"
+                         for device, count in running.items() if count)
+        print_quiet(f"Progress: {directories} directories, {files_seen} files, {format_size(bytes_seen)} "
+                    f"in {elapsed:.0f}s ({directories / elapsed:.0f} dirs/s, {files_seen / elapsed:.0f} files/s), "
+                    f"{outstanding} pending; listing on {busy or 'nothing'}")
+
+    def next_finished():
+        # With progress enabled, a line is printed every interval even while
+        # every worker is stuck, naming the mounts they are stuck on.
+        if not progress:
+            return finished.get()
+        while True:
+            try:
+                return finished.get(timeout=max(0.0, next_progress[0] - time.time()))
+            except queue.Empty:
+                report_progress()
+                next_progress[0] = time.time() + progress
+
+    next_progress = [start_time + (progress or 0)]
+    with profile_utils.phase("walk"), concurrent.futures.ThreadPoolExecutor(max_workers=jobs) as pool:
+        def submit(node):
+            rel_dir = node[0][len(directory):].lstrip(os.sep)
+            future = pool.submit(read_directory, node[0], rel_dir + os.sep if rel_dir else "", file_filter,
+                                 scan_type, allocated, sniff)
+            future.add_done_callback(lambda f: finished.put((node, f)))
+
+        def dispatch():
+            in_flight = sum(running.values())
+            while in_flight < jobs:
+                # A device scanned on its own may use every worker
+                active = set(waiting).union(device for device, count in running.items() if count)
+                limit = per_device if len(active) > 1 else jobs
+                ready = [device for device in waiting if running[device] < limit]
+                if not ready:
+                    return
+                device = min(ready, key=running.__getitem__)
+                submit(waiting[device].popleft())
+                if not waiting[device]:
+                    del waiting[device]
+                running[device] += 1
+                in_flight += 1
+
+        waiting[root_mount] = collections.deque([[directory, 0, None, 0, 0, True, 0, root_mount]])
+        dispatch()
+        outstanding = 1
+        while outstanding:
+            node, future = next_finished()
+            outstanding -= 1
+            running[node[7]] -= 1
+            if progress and time.time() >= next_progress[0]:
+                report_progress()
+                next_progress[0] = time.time() + progress
+            try:
+                dir_stat, record, fresh, (calls, errors, seconds) = future.result()
+            except OSError as e:
+                print_verbose(f"Error accessing {node[0]}")
+                if profile:
+                    profile.error(e)
+                node[5] = False
+                complete(node)
+                dispatch()
+                continue
+
+            if root_dev is None:
+                root_dev = dir_stat.st_dev
+            elif one_file_system and dir_stat.st_dev != root_dev:
+                # A mount the mount table didn't show, such as an automount
+                print_verbose(f"Skipping {node[0]}: other filesystem")
+                node[5] = False
+                complete(node)
+                dispatch()
+                continue
+
+            if fresh:
+                reread += 1
+                if folder_size_cache:
+                    folder_size_cache.store(dir_stat, record)
+            else:
+                reused += 1
+            stat_calls += calls
+            stat_errors += errors
+            if profile:
+                profile.directory_time(node[0], seconds)
+
+            own_size, files, subdirs, links, own_count = record
+            counted_links = set()
+            for link, (dev, ino, size) in enumerate(links):
+                if (dev, ino) not in seen_inodes:
+                    seen_inodes.add((dev, ino))
+                    counted_links.add(link)
+                    own_size += size
+            node[3] = own_size + disk_size(dir_stat, allocated)
+            node[6] = own_count + len(counted_links) + 1
+            directories += 1
+            files_seen += node[6] - 1
+            bytes_seen += node[3]
+            if node[1] <= max_depth or not output_utils.HIDE_DEEP_FILES:
+                for name, file_size, file_type, link, apparent in files:
+                    if link >= 0 and link not in counted_links:
+                        continue
+                    if not sniff:
+                        keep_file((node, name, file_size, file_type))
+                    elif file_size > threshold:
+                        unsniffed.append((node, name, file_size, file_type))
+                    if duplicates is not None and file_size > threshold:
+                        duplicates.setdefault(apparent, []).append(
+                            (os.path.join(node[0], name), (node, name, file_size, file_type)))
+            for name in subdirs:
+                path = os.path.join(node[0], name)
+                device = node[7]
+                mount = child_mounts.get(path)
+                if mount is not None:
+                    if is_pseudo(mount) and not pseudo_filesystems:
+                        print_verbose(f"Skipping {path}: {mount.fstype} filesystem")
+                        continue
+                    if one_file_system and (root_mount is None or mount.device != root_mount.device):
+                        print_verbose(f"Skipping {path}: other filesystem")
+                        continue
+                    device = mount
+                node[4] += 1
+                waiting.setdefault(device, collections.deque()).append([path, node[1] + 1, node, 0, 0, True, 0, device])
+                outstanding += 1
+            if not node[4]:
+                complete(node)
+            dispatch()
 
     end_time = time.time()
     print_quiet(f"Scan completed in {end_time - start_time:.2f} seconds")
+    if folder_size_cache:
+        print_verbose(f"Scan index: {reused} directories reused, {reread} re-read")
+    if profile:
+        for name, value in (("directories", directories), ("files", files_seen), ("bytes", bytes_seen),
+                            ("scandir_calls", reread), ("stat_calls", stat_calls), ("stat_errors", stat_errors),
+                            ("scan_index_hits", reused if folder_size_cache else 0),
+                            ("scan_index_misses", reread if folder_size_cache else 0)):
+            profile.count(name, value)
+
+    if sniff:
+        with profile_utils.phase("sniff"):
+            for file in sniff_candidates(unsniffed, scan_type, jobs):
+                keep_file(file)
 
-    return (sorted(large_files, key=lambda x: x[1], reverse=True),
-            sorted(large_folders, key=lambda x: x[1], reverse=True))
+    duplicate_groups = []
+    if duplicates is not None:
+        with profile_utils.phase("duplicates"):
+            duplicate_groups = find_duplicates(duplicates, min(jobs, os.cpu_count() or 1), lambda file: file[2])
+        print_quiet(f"Duplicate search completed in {time.time() - end_time:.2f} seconds")
 
-def run_scan(directory: str, ignore_list: List[str], scan_type: str, max_depth: int) -> Tuple[List[Tuple[str, int, str]], List[Tuple[str, int]]]:
-    return asyncio.run(scan_directory(directory, ignore_list, scan_type, max_depth))
+    with profile_utils.phase("collect_results"):
+        return collect_results(large_files, large_folders, duplicate_groups)
+
+def run_scan(directory: str, file_filter: FileFilter, scan_type: str, max_depth: int, index_path: Optional[str] = None, jobs: int = DEFAULT_JOBS, allocated: bool = False, threshold: int = 0, top: Optional[int] = None, sniff: bool = False, one_file_system: bool = False, pseudo_filesystems: bool = False, snapshot_path: Optional[str] = None, progress: Optional[float] = None, export: Optional[RecordWriter] = None) -> ScanResults:
+    global folder_size_cache
+    folder_size_cache = open_index(index_path, index_params(scan_type, file_filter, allocated, sniff, directory)) if index_path else None
+    snapshot = SnapshotWriter(snapshot_path, directory) if snapshot_path else None
+    try:
+        results = scan_directory(directory, file_filter, scan_type, max_depth, jobs, allocated, threshold, top, sniff,
+                                 one_file_system, pseudo_filesystems, snapshot, progress, export)
+        if snapshot:
+            with profile_utils.phase("snapshot"):
+                snapshot.close()
+            print_verbose(f"Snapshot written to {snapshot_path}")
+        return results
+    finally:
+        if snapshot:
+            snapshot.discard()
+        if folder_size_cache:
+            folder_size_cache.close()
@@ -0,0 +1,170 @@
+import os
+import time
+import heapq
+import struct
+import tempfile
+import itertools
+from typing import BinaryIO, Iterable, Iterator, List, Optional, Tuple
+
+# Snapshot files start with SNAPSHOT_MAGIC, the scanned directory and the scan
+# time, followed by (relative path, total size) records sorted by path. Each
+# path is stored as the length of the prefix it shares with the previous one
+# plus the remaining bytes, which keeps deep trees compact.
+SNAPSHOT_MAGIC = b"LLSNAP1\n"
+HEADER = struct.Struct("<Hd")
+RECORD = struct.Struct("<HHq")
+# Records sorted in memory before being spilled to a temporary run
+CHUNK_RECORDS = 100000
+DIFF_LIMIT = 20
+
+Record = Tuple[bytes, int]
+
+def shared_prefix(a: bytes, b: bytes) -> int:
+    # Binary search on slice comparisons, which run in C
+    low, high = 0, min(len(a), len(b), 0xFFFF)
+    while low < high:
+        middle = (low + high + 1) // 2
+        if a[:middle] == b[:middle]:
+            low = middle
+        else:
+            high = middle - 1
+    return low
+
+def write_records(f: BinaryIO, records: Iterable[Record]):
+    previous = b""
+    for path, size in records:
+        shared = shared_prefix(path, previous)
+        f.write(RECORD.pack(shared, len(path) - shared, size))
+        f.write(path[shared:])
+        previous = path
+
+def read_records(f: BinaryIO) -> Iterator[Record]:
+    previous = b""
+    while True:
+        header = f.read(RECORD.size)
+        if len(header) < RECORD.size:
+            return
+        shared, length, size = RECORD.unpack(header)
+        previous = previous[:shared] + f.read(length)
+        yield previous, size
+
+class SnapshotReader:
+    def __init__(self, path: str):
+        self._file = open(path, "rb")
+        try:
+            if self._file.read(len(SNAPSHOT_MAGIC)) != SNAPSHOT_MAGIC:
+                raise ValueError(f"Not a snapshot file: {path}")
+            root_length, self.created = HEADER.unpack(self._file.read(HEADER.size))
+            self.root = os.fsdecode(self._file.read(root_length))
+        except (ValueError, struct.error):
+            self._file.close()
+            raise ValueError(f"Not a snapshot file: {path}")
+
+    def __iter__(self) -> Iterator[Record]:
+        return read_records(self._file)
+
+    def close(self):
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+# Collects directory sizes in any order and writes them sorted. Memory is
+# bounded by CHUNK_RECORDS: full chunks are sorted and spilled to temporary
+# runs, which are merged into the snapshot when it is closed.
+class SnapshotWriter:
+    def __init__(self, path: str, root: str):
+        self.path = path
+        self.root = root
+        self.created = time.time()
+        self._chunk: List[Record] = []
+        self._runs: List[str] = []
+
+    def add(self, rel_path: str, size: int):
+        self._chunk.append((os.fsencode(rel_path), size))
+        if len(self._chunk) >= CHUNK_RECORDS:
+            self._spill()
+
+    def _spill(self):
+        self._chunk.sort()
+        fd, run_path = tempfile.mkstemp(prefix="linuxlaunder-run-")
+        self._runs.append(run_path)
+        with os.fdopen(fd, "wb", buffering=1024 * 1024) as f:
+            write_records(f, self._chunk)
+        self._chunk = []
+
+    def close(self):
+        self._chunk.sort()
+        runs = [open(run_path, "rb", buffering=1024 * 1024) for run_path in self._runs]
+        directory = os.path.dirname(os.path.abspath(self.path))
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(prefix=".snapshot-", dir=directory)
+        try:
+            with os.fdopen(fd, "wb", buffering=1024 * 1024) as f:
+                root = os.fsencode(self.root)
+                f.write(SNAPSHOT_MAGIC + HEADER.pack(len(root), self.created) + root)
+                write_records(f, heapq.merge(self._chunk, *(read_records(run) for run in runs)))
+            os.replace(tmp_path, self.path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+        finally:
+            for run in runs:
+                run.close()
+            self.discard()
+
+    def discard(self):
+        for run_path in self._runs:
+            try:
+                os.unlink(run_path)
+            except OSError:
+                pass
+        self._runs = []
+        self._chunk = []
+
+def push_change(heap: List, limit: int, delta: int, counter: Iterator[int], change: Tuple[str, int, int]):
+    entry = (delta, next(counter), change)
+    if len(heap) < limit:
+        heapq.heappush(heap, entry)
+    elif delta > heap[0][0]:
+        heapq.heapreplace(heap, entry)
+
+# Walks both snapshots in path order at once, so memory only holds the two
+# current records and the top changes, however many directories there are.
+# Directories missing from one side count as 0 there.
+def diff_snapshots(old_path: str, new_path: str, limit: int = DIFF_LIMIT) -> Tuple[List[Tuple[str, int, int]], List[Tuple[str, int, int]]]:
+    growers: List = []
+    shrinkers: List = []
+    counter = itertools.count()
+    with SnapshotReader(old_path) as old, SnapshotReader(new_path) as new:
+        old_records = iter(old)
+        new_records = iter(new)
+        a = next(old_records, None)
+        b = next(new_records, None)
+        while a is not None or b is not None:
+            if b is None or (a is not None and a[0] < b[0]):
+                path, old_size, new_size = a[0], a[1], 0
+                a = next(old_records, None)
+            elif a is None or b[0] < a[0]:
+                path, old_size, new_size = b[0], 0, b[1]
+                b = next(new_records, None)
+            else:
+                path, old_size, new_size = a[0], a[1], b[1]
+                a = next(old_records, None)
+                b = next(new_records, None)
+            delta = new_size - old_size
+            if delta:
+                change = (os.path.join(new.root, os.fsdecode(path)) if path else new.root, old_size, new_size)
+                push_change(growers if delta > 0 else shrinkers, limit, abs(delta), counter, change)
+    return ([change for _, _, change in sorted(growers, reverse=True)],
+            [change for _, _, change in sorted(shrinkers, reverse=True)])
+
+def snapshot_info(path: str) -> Optional[Tuple[str, float]]:
+    try:
+        with SnapshotReader(path) as snapshot:
+            return snapshot.root, snapshot.created
+    except (OSError, ValueError):
+        return None
@@ -0,0 +1,30 @@
+import os
+import tempfile
+import unittest
+
+from export_utils import RecordWriter
+
+class RecordWriterTest(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.root.name, "out")
+
+    def tearDown(self):
+        self.root.cleanup()
+
+    def export(self, fmt: str) -> bytes:
+        writer = RecordWriter(fmt, self.path)
+        writer.record('file', os.fsdecode(b'/data/bad\xffname'), 10, 'other')
+        writer.close()
+        with open(self.path, "rb") as f:
+            return f.read()
+
+    def test_undecodable_paths_keep_their_bytes(self):
+        for fmt in ('ndjson', 'csv'):
+            with self.subTest(fmt=fmt):
+                output = self.export(fmt)
+                self.assertIn(b'/data/bad\xffname', output)
+                self.assertNotIn(b'udcff', output)
+
+if __name__ == "__main__":
+    unittest.main()
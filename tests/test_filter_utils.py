@@ -0,0 +1,30 @@
+import unittest
+
+from filter_utils import FileFilter
+
+class BracketRuleTest(unittest.TestCase):
+    def excluded(self, rule: str, name: str) -> bool:
+        return FileFilter([rule]).excludes_path(name, name)
+
+    def test_sets_and_negated_sets(self):
+        self.assertTrue(self.excluded('[ab].txt', 'a.txt'))
+        self.assertFalse(self.excluded('[!ab].txt', 'a.txt'))
+        self.assertTrue(self.excluded('[!ab].txt', 'c.txt'))
+
+    def test_leading_bracket_is_part_of_the_set(self):
+        self.assertTrue(self.excluded('[]]', ']'))
+        self.assertTrue(self.excluded('[!]]x', 'ax'))
+        self.assertFalse(self.excluded('[!]]x', ']x'))
+
+    def test_unclosed_sets_are_literal(self):
+        self.assertTrue(self.excluded('[!]', '[!]'))
+        self.assertTrue(self.excluded('a[', 'a['))
+
+    def test_invalid_rules_raise_value_error(self):
+        with self.assertRaisesRegex(ValueError, r'\[z-a\]\.txt'):
+            FileFilter(['*.log', '[z-a].txt'])
+        with self.assertRaisesRegex(ValueError, r'!dir/\[z-a\]/'):
+            FileFilter(['!dir/[z-a]/'])
+
+if __name__ == "__main__":
+    unittest.main()
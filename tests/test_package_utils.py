@@ -0,0 +1,120 @@
+import os
+import stat
+import tempfile
+import unittest
+from unittest import mock
+
+from package_utils import Package, read_package_db, removal_plan, uninstall_packages
+
+def write(path: str, text: str):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w") as f:
+        f.write(text)
+
+class PacmanDbTest(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.TemporaryDirectory()
+        db = os.path.join(self.root.name, "var/lib/pacman/local")
+        write(os.path.join(db, "app-1.0-1/desc"),
+              "%NAME%\napp\n\n%SIZE%\n3000\n\n%REASON%\n0\n\n%DEPENDS%\nglibc>=2.38\nlibfoo\n\n")
+        write(os.path.join(db, "glibc-2.39-1/desc"),
+              "%NAME%\nglibc\n\n%SIZE%\n1000\n\n%REASON%\n1\n\n%PROVIDES%\nlibc.so=6-64\n\n")
+        write(os.path.join(db, "broken-1.0-1/desc"), "%NAME%\nbroken\n\n%SIZE%\nabc\n\n")
+        write(os.path.join(db, "nameless-1.0-1/desc"), "%SIZE%\n10\n\n")
+
+    def tearDown(self):
+        self.root.cleanup()
+
+    def test_reads_packages_and_skips_unparsable_ones(self):
+        packages = sorted(read_package_db('arch', self.root.name))
+        self.assertEqual(packages, [
+            Package("app", 3000, ("glibc", "libfoo"), (), True),
+            Package("glibc", 1000, (), ("libc.so",), False),
+        ])
+
+class DpkgStatusTest(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.TemporaryDirectory()
+        write(os.path.join(self.root.name, "var/lib/dpkg/status"),
+              "Package: app\nStatus: install ok installed\nInstalled-Size: 3\n"
+              "Pre-Depends: libc6 (>= 2.34)\nDepends: python3:any, mawk | gawk\n"
+              "Description: an app\n Depends: not a field\n\n"
+              "Package: libc6\nStatus: install ok installed\nInstalled-Size: 2\nProvides: libc-dev (= 2.39)\n\n"
+              "Package: removed\nStatus: deinstall ok config-files\nInstalled-Size: 5\n\n"
+              "Package: broken\nStatus: install ok installed\nInstalled-Size: lots\n\n")
+        write(os.path.join(self.root.name, "var/lib/apt/extended_states"),
+              "Package: libc6\nArchitecture: amd64\nAuto-Installed: 1\n\n")
+
+    def tearDown(self):
+        self.root.cleanup()
+
+    def test_reads_installed_packages_and_skips_unparsable_ones(self):
+        packages = sorted(read_package_db('ubuntu', self.root.name))
+        self.assertEqual(packages, [
+            Package("app", 3 * 1024, ("libc6", "python3", "mawk", "gawk"), (), True),
+            Package("libc6", 2 * 1024, (), ("libc-dev",), False),
+        ])
+
+class RemovalPlanTest(unittest.TestCase):
+    packages = [
+        Package("app", 300, ("libfoo", "glibc")),
+        Package("other", 100, ("glibc",)),
+        Package("libfoo", 200, ("libbar",), explicit=False),
+        Package("libbar", 50, explicit=False),
+        Package("glibc", 500, explicit=False),
+        # Already unneeded before anything is removed, and still using libbar
+        Package("stale", 10, ("libbar",), explicit=False),
+    ]
+
+    def test_orphans_are_new_and_unused_by_what_stays(self):
+        removed, orphans = removal_plan(self.packages, ["app"])
+        self.assertEqual([package.name for package in removed], ["app"])
+        # glibc is still needed by other, libbar by the older orphan stale
+        self.assertEqual([package.name for package in orphans], ["libfoo"])
+
+    def test_dependencies_of_kept_orphans_are_kept(self):
+        packages = self.packages + [Package("libbaz", 5, explicit=False)]
+        packages[3] = Package("libbar", 50, ("libbaz",), explicit=False)
+        _, orphans = removal_plan(packages, ["app"])
+        self.assertEqual([package.name for package in orphans], ["libfoo"])
+
+class UninstallTest(unittest.TestCase):
+    def setUp(self):
+        # Stub package managers and sudo on PATH, each recording its arguments
+        self.bin = tempfile.TemporaryDirectory()
+        self.log = os.path.join(self.bin.name, "calls")
+        for name in ("pacman", "apt-get", "sudo"):
+            path = os.path.join(self.bin.name, name)
+            with open(path, "w") as f:
+                f.write(f'#!/bin/sh\necho "{name} $*" >> "{self.log}"\n')
+                if name == "sudo":
+                    f.write('exec "$@"\n')
+            os.chmod(path, stat.S_IRWXU)
+        self.path = mock.patch.dict(os.environ, {"PATH": self.bin.name + os.pathsep + os.environ.get("PATH", "")})
+        self.path.start()
+
+    def tearDown(self):
+        self.path.stop()
+        self.bin.cleanup()
+
+    def calls(self):
+        with open(self.log) as f:
+            return [line.split() for line in f]
+
+    def test_pacman_removes_exactly_the_named_packages(self):
+        uninstall_packages(["app", "libfoo"], 'arch')
+        self.assertEqual(self.calls()[-1][1:], ["-R", "app", "libfoo"])
+
+    def test_apt_removes_without_auto_remove(self):
+        uninstall_packages(["app", "libfoo"], 'ubuntu')
+        self.assertEqual(self.calls()[-1][1:], ["remove", "app", "libfoo"])
+
+    def test_stub_on_path_is_used_under_sudo(self):
+        with mock.patch("os.geteuid", return_value=1000):
+            uninstall_packages(["app"], 'arch')
+        calls = self.calls()
+        self.assertEqual(calls[0], ["sudo", os.path.join(self.bin.name, "pacman"), "-R", "app"])
+        self.assertEqual(calls[1], ["pacman", "-R", "app"])
+
+if __name__ == "__main__":
+    unittest.main()
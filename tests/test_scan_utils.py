@@ -0,0 +1,62 @@
+import os
+import tempfile
+import threading
+import time
+import unittest
+from unittest import mock
+
+from filter_utils import FileFilter
+from output_utils import set_output_mode
+import scan_utils
+from scan_utils import run_scan
+
+def write(path: str, data: bytes):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as f:
+        f.write(data)
+
+class RunScanTest(unittest.TestCase):
+    def setUp(self):
+        set_output_mode(False, True, False)
+        self.root = tempfile.TemporaryDirectory()
+        # An executable without an extension is only found by its header
+        write(os.path.join(self.root.name, "bin/tool"), b'\x7fELF' + b'\0' * 4096)
+        write(os.path.join(self.root.name, "notes.txt"), b'x' * 4096)
+        write(os.path.join(self.root.name, "small"), b'\x7fELF')
+
+    def tearDown(self):
+        self.root.cleanup()
+
+    def files(self, scan_type: str, sniff: bool):
+        results = run_scan(self.root.name, FileFilter([]), scan_type, 4, None, 2, False, 1000, None, sniff)
+        return sorted((os.path.relpath(path, self.root.name), file_type) for path, _, file_type in results.files())
+
+    def test_sniff_finds_files_by_content(self):
+        self.assertEqual(self.files('malicious', True), [("bin/tool", 'malicious')])
+        self.assertEqual(self.files('malicious', False), [])
+
+    def test_sniff_keeps_name_categories_in_full_scans(self):
+        self.assertEqual(self.files('all', True), [("bin/tool", 'malicious'), ("notes.txt", 'document')])
+
+    def test_single_device_uses_every_worker(self):
+        for i in range(6):
+            os.makedirs(os.path.join(self.root.name, f"dir{i}"))
+        lock = threading.Lock()
+        listing = [0, 0]
+        read_directory = scan_utils.read_directory
+
+        def slow_read(*args):
+            with lock:
+                listing[0] += 1
+                listing[1] = max(listing)
+            time.sleep(0.05)
+            with lock:
+                listing[0] -= 1
+            return read_directory(*args)
+
+        with mock.patch.object(scan_utils, "read_directory", slow_read):
+            run_scan(self.root.name, FileFilter([]), 'all', 4, None, 3)
+        self.assertEqual(listing[1], 3)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,293 @@
+import curses
+import itertools
+from typing import Dict, List, Optional, Set, Tuple
+from output_utils import format_size
+
+TREE_INDENT = "│   "
+HELP_LINE = ("Arrows/PgUp/PgDn to navigate, Enter to expand/collapse, Space to select, "
+             "'p' parent, '/' search, 'n' next match, 'q' to confirm")
+
+class TreeNode:
+    def __init__(self, name, path, size, is_file=False):
+        self.name = name
+        self.path = path
+        self.size = size
+        self.is_file = is_file
+        # Number of inodes removed along with this node
+        self.count = 1
+        self.children = []
+        self.parent = None
+        self.depth = 0
+        self.expanded = False
+        # (stamp, selected) of the last Space press on this node, if any
+        self.mark = None
+
+    def add_child(self, child):
+        child.parent = self
+        child.depth = self.depth + 1
+        self.children.append(child)
+
+# Visible rows of a tree, kept as a flat list that expand/collapse splice in
+# place. Selection is lazy: Space only stamps the node it was pressed on, and
+# the most recent stamp on a node's ancestor chain decides whether it is
+# selected, so selecting a folder never walks its subtree. Marked nodes and
+# their ancestors form a small forest, which is all a Space press walks to
+# update the selected size.
+class TreeView:
+    def __init__(self, root: TreeNode):
+        self.root = root
+        self.rows: List[TreeNode] = [root] if root.name else list(root.children)
+        self.current = 0
+        self.top = 0
+        self.marked: List[TreeNode] = []
+        self.selected_bytes = 0
+        # Children on the path to a marked node, keyed by id of the parent
+        self._forest: Dict[int, List[TreeNode]] = {}
+        self._linked: Set[int] = set()
+        self._children_sizes: Dict[int, int] = {}
+        self._stamps = itertools.count(1)
+        self._order: Optional[List[TreeNode]] = None
+        self._order_index: Dict[int, int] = {}
+        self.last_query = ""
+
+    def visible_descendants(self, node: TreeNode) -> List[TreeNode]:
+        visible = []
+        pending = list(reversed(node.children))
+        while pending:
+            child = pending.pop()
+            visible.append(child)
+            if child.expanded:
+                pending.extend(reversed(child.children))
+        return visible
+
+    def toggle_expand(self, index: int):
+        node = self.rows[index]
+        if not node.children:
+            return
+        if node.expanded:
+            end = index + 1
+            while end < len(self.rows) and self.rows[end].depth > node.depth:
+                end += 1
+            del self.rows[index + 1:end]
+            node.expanded = False
+        else:
+            node.expanded = True
+            self.rows[index + 1:index + 1] = self.visible_descendants(node)
+
+    def is_selected(self, node: Optional[TreeNode]) -> bool:
+        stamp, selected = 0, False
+        while node is not None:
+            if node.mark and node.mark[0] > stamp:
+                stamp, selected = node.mark
+            node = node.parent
+        return selected
+
+    def toggle_select(self, node: TreeNode):
+        if node.mark is None:
+            self.marked.append(node)
+            self.add_to_forest(node)
+        node.mark = (next(self._stamps), not self.is_selected(node))
+        self.selected_bytes = self.selection(collect=False)[0]
+
+    def add_to_forest(self, node: TreeNode):
+        # Stops at the first node already linked, whose ancestors are too
+        while node.parent is not None and id(node) not in self._linked:
+            self._linked.add(id(node))
+            self._forest.setdefault(id(node.parent), []).append(node)
+            node = node.parent
+
+    def children_size(self, node: TreeNode) -> int:
+        # Sizes never change, so each folder's total is summed once
+        size = self._children_sizes.get(id(node))
+        if size is None:
+            size = self._children_sizes[id(node)] = sum(child.size for child in node.children)
+        return size
+
+    def selection(self, collect: bool = True) -> Tuple[int, List[TreeNode]]:
+        # Post-order over the forest, carrying the latest mark down. A selected
+        # folder with deselected descendants (holes) is replaced by its selected
+        # children; unmarked children are sized through children_size and only
+        # listed when collect is set, for the final selection.
+        results: Dict[int, Tuple[int, bool, List[TreeNode]]] = {}
+        stack = [(self.root, (0, False), False)]
+        while stack:
+            node, inherited, visited = stack.pop()
+            mark = node.mark if node.mark and node.mark[0] > inherited[0] else inherited
+            children = self._forest.get(id(node), [])
+            if children and not visited:
+                stack.append((node, inherited, True))
+                stack.extend((child, mark, False) for child in children)
+                continue
+            size, holes, nodes, covered = 0, False, [], 0
+            for child in children:
+                child_size, child_holes, child_nodes = results.pop(id(child))
+                size += child_size
+                holes = holes or child_holes
+                nodes.extend(child_nodes)
+                covered += child.size
+            selected = mark[1]
+            if selected and not holes and node.name:
+                size, nodes = node.size, [node]
+            elif selected and holes:
+                size += self.children_size(node) - covered
+                if collect:
+                    in_forest = {id(child) for child in children}
+                    nodes.extend(child for child in node.children if id(child) not in in_forest)
+            results[id(node)] = (size, holes or (node.mark is not None and not selected), nodes)
+        size, _, nodes = results[id(self.root)]
+        return size, nodes
+
+    def selected_nodes(self) -> List[TreeNode]:
+        return self.selection()[1]
+
+    def selected_paths(self) -> List[str]:
+        return [node.path for node in self.selected_nodes()]
+
+    def move(self, delta: int):
+        if self.rows:
+            self.current = max(0, min(len(self.rows) - 1, self.current + delta))
+
+    def jump_to_parent(self):
+        if not self.rows:
+            return
+        depth = self.rows[self.current].depth
+        index = self.current - 1
+        while index >= 0 and self.rows[index].depth >= depth:
+            index -= 1
+        if index >= 0:
+            self.current = index
+
+    def scroll_into_view(self, page: int):
+        if self.current < self.top:
+            self.top = self.current
+        elif self.current >= self.top + page:
+            self.top = self.current - page + 1
+        self.top = max(0, min(self.top, max(0, len(self.rows) - page)))
+
+    def reveal(self, node: TreeNode):
+        ancestors = []
+        parent = node.parent
+        while parent is not None and parent is not self.root:
+            ancestors.append(parent)
+            parent = parent.parent
+        for ancestor in reversed(ancestors):
+            if not ancestor.expanded:
+                self.toggle_expand(self.rows.index(ancestor))
+        self.current = self.rows.index(node)
+
+    def search(self, query: str, skip_current: bool = False) -> bool:
+        self.last_query = query
+        if not query or not self.rows:
+            return False
+        if self._order is None:
+            self._order = []
+            pending = [self.root] if self.root.name else list(reversed(self.root.children))
+            while pending:
+                node = pending.pop()
+                self._order.append(node)
+                pending.extend(reversed(node.children))
+            self._order_index = {id(node): i for i, node in enumerate(self._order)}
+        query = query.lower()
+        start = self._order_index[id(self.rows[self.current])] + (1 if skip_current else 0)
+        count = len(self._order)
+        for offset in range(count):
+            node = self._order[(start + offset) % count]
+            if query in node.name.lower():
+                self.reveal(node)
+                return True
+        return False
+
+    def row_text(self, node: TreeNode, width: int) -> str:
+        if self.is_selected(node):
+            expander = "x"
+        elif node.children:
+            expander = "-" if node.expanded else "+"
+        else:
+            expander = " "
+        text = f"{TREE_INDENT * max(0, node.depth - 1)}[{expander}] {node.name} ({format_size(node.size)})"
+        if len(text) > width - 3:
+            text = text[:width - 6] + "..."
+        return text
+
+def interactive_selection(stdscr, root_node, title):
+    curses.curs_set(0)
+    stdscr.erase()
+    view = TreeView(root_node)
+    drawn = {}
+    query = None
+
+    def draw(y, text, attr=curses.A_NORMAL):
+        # Only rows whose content changed are sent to the terminal
+        if drawn.get(y) != (text, attr):
+            stdscr.addnstr(y, 0, text, max(0, width - 1), attr)
+            stdscr.clrtoeol()
+            drawn[y] = (text, attr)
+
+    while True:
+        height, width = stdscr.getmaxyx()
+        page = max(1, height - 3)
+        view.scroll_into_view(page)
+
+        draw(0, title, curses.A_BOLD)
+        draw(1, HELP_LINE)
+        for y in range(page):
+            index = view.top + y
+            if index >= len(view.rows):
+                draw(y + 2, "")
+            elif index == view.current:
+                draw(y + 2, "> " + view.row_text(view.rows[index], width - 2), curses.A_BOLD)
+            else:
+                draw(y + 2, "  " + view.row_text(view.rows[index], width - 2))
+        status = f"Selected: {format_size(view.selected_bytes)}"
+        if query is not None:
+            status += f"  Search: {query}"
+        draw(height - 1, status, curses.A_REVERSE)
+        stdscr.refresh()
+
+        key = stdscr.getch()
+        if key == curses.KEY_RESIZE:
+            drawn.clear()
+            stdscr.erase()
+        elif query is not None:
+            if key in (10, 27, curses.KEY_ENTER):
+                query = None
+            elif key in (curses.KEY_BACKSPACE, 127, 8):
+                query = query[:-1]
+                view.search(query)
+            elif 32 <= key < 127:
+                query += chr(key)
+                view.search(query)
+        elif key == ord('q'):
+            return view.selected_nodes()
+        elif not view.rows:
+            continue
+        elif key == ord(' '):
+            view.toggle_select(view.rows[view.current])
+        elif key in (10, curses.KEY_ENTER):
+            view.toggle_expand(view.current)
+        elif key == curses.KEY_RIGHT:
+            if not view.rows[view.current].expanded:
+                view.toggle_expand(view.current)
+        elif key == curses.KEY_LEFT:
+            if view.rows[view.current].expanded:
+                view.toggle_expand(view.current)
+            else:
+                view.jump_to_parent()
+        elif key == ord('p'):
+            view.jump_to_parent()
+        elif key == ord('/'):
+            query = ""
+        elif key == ord('n'):
+            view.search(view.last_query, skip_current=True)
+        elif key == curses.KEY_UP:
+            view.move(-1)
+        elif key == curses.KEY_DOWN:
+            view.move(1)
+        elif key == curses.KEY_PPAGE:
+            view.move(-page)
+        elif key == curses.KEY_NPAGE:
+            view.move(page)
+        elif key == curses.KEY_HOME:
+            view.move(-len(view.rows))
+        elif key == curses.KEY_END:
+            view.move(len(view.rows))